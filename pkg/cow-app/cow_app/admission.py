@@ -0,0 +1,78 @@
+"""
+Admission control for the prediction routes.
+
+At most `max_concurrency` requests run the pipeline at once; up to `max_queue` more wait for a slot, each
+for at most `queue_timeout` seconds. A full queue is rejected immediately with 429, a wait that times out
+with 503; both carry a Retry-After estimated from recent service times.
+"""
+from typing import Callable
+import asyncio
+import math
+import time
+
+from cow_core.metrics import counter, gauge, histogram
+
+QUEUE_DEPTH = gauge("cow_admission_queue_depth", "Requests waiting for a pipeline slot.")
+IN_FLIGHT = gauge("cow_admission_in_flight", "Requests holding a pipeline slot.")
+QUEUE_WAIT = histogram("cow_admission_queue_wait_seconds", "Time spent waiting for a pipeline slot.")
+REJECTED = counter("cow_admission_rejected_total", "Requests rejected by admission control.", ("reason",))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status: int, retry_after: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.message = message
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 32, queue_timeout: float = 10.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._waiting = 0
+        # Moving average of how long a request holds its slot, for Retry-After
+        self._service_time = 5.0
+
+    def retry_after(self) -> int:
+        """Seconds until a new request would likely get a slot."""
+        rounds = (self._waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(rounds * self._service_time))
+
+    async def acquire(self) -> Callable[[], None]:
+        """Wait for a slot; returns an idempotent release function. Raises AdmissionRejected."""
+        if self._semaphore.locked():
+            if self._waiting >= self.max_queue:
+                REJECTED.inc(reason="queue_full")
+                raise AdmissionRejected(429, self.retry_after(), "Server busy, please retry later")
+            self._waiting += 1
+            QUEUE_DEPTH.set(self._waiting)
+            t0 = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                REJECTED.inc(reason="queue_timeout")
+                raise AdmissionRejected(503, self.retry_after(), "Server busy, timed out waiting in queue")
+            finally:
+                self._waiting -= 1
+                QUEUE_DEPTH.set(self._waiting)
+                QUEUE_WAIT.observe(time.perf_counter() - t0)
+        else:
+            await self._semaphore.acquire()
+            QUEUE_WAIT.observe(0.0)
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.perf_counter() - started)
+            IN_FLIGHT.dec()
+            self._semaphore.release()
+
+        return release
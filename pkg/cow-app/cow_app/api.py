@@ -1,7 +1,9 @@
 """
-Minimal chat API for CoW Protocol: health check + /predict.
+Minimal chat API for CoW Protocol: health check + /predict (+ /predict/stream, server-sent events) + /metrics.
 Uses cow_brains for RAG (docs, Order Book API, CoW Swap, CoW SDK).
 """
+import asyncio
+import json
 import os
 import time
 from pathlib import Path
@@ -12,12 +14,28 @@ if _env_file.is_file():
     from dotenv import load_dotenv
     load_dotenv(_env_file)
 
-from quart import Quart, request, jsonify
+from quart import Quart, request, jsonify, make_response
 from quart_cors import cors
 
-from cow_brains import process_question
+from cow_app.admission import AdmissionController, AdmissionRejected
+from cow_brains import process_question, stream_question, get_pipeline
+from cow_brains.config import COW_FAISS_PATH
+from cow_brains.pipeline import current_pipeline
+from cow_brains.sessions import current_session_store
+from cow_core.metrics import counter, gauge, histogram, render as render_metrics
+from cow_core.tracing import start_trace
+from rag_brains.chat.gemini_adapter import gemini_executor_stats
 from rag_brains.exceptions import UnsupportedVectorstoreError
 
+REQUEST_SECONDS = histogram("cow_request_seconds", "End-to-end latency of prediction requests.", ("route", "status"))
+FIRST_TOKEN_SECONDS = histogram("cow_stream_first_token_seconds", "Time to the first answer token on /predict/stream.")
+CLIENT_DISCONNECTS = counter(
+    "cow_client_disconnects_total", "Prediction requests abandoned by the client before the answer was sent.", ("route",)
+)
+COMPONENT_STATS = gauge(
+    "cow_component_stat", "Counters of the Gemini executor, caches and embedder (their stats()).", ("component", "stat")
+)
+
 
 def _has_google_key():
     key = (os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY") or "").strip()
@@ -41,6 +59,34 @@ app = Quart(__name__)
 app.config["SECRET_KEY"] = os.getenv("FLASK_API_SECRET_KEY", "dev-secret")
 app = cors(app)
 
+# Concurrency limit for the prediction routes, with a bounded wait queue (see cow_app.admission)
+admission = AdmissionController(
+    max_concurrency=int(os.getenv("COW_MAX_CONCURRENCY", "8")),
+    max_queue=int(os.getenv("COW_MAX_QUEUE", "32")),
+    queue_timeout=float(os.getenv("COW_QUEUE_TIMEOUT", "10")),
+)
+
+
+@app.before_serving
+async def warm_pipeline():
+    """Build the RAG pipeline (FAISS retriever, LLM adapters, DataExporter snapshot) once per worker."""
+    if not os.path.isdir(COW_FAISS_PATH):
+        return
+    t0 = time.perf_counter()
+    try:
+        await get_pipeline()
+    except Exception as e:
+        print(f"WARNING: RAG pipeline warm-up failed: {e}", flush=True)
+        return
+    print(f"RAG pipeline ready in {time.perf_counter() - t0:.2f}s", flush=True)
+
+
+def _disconnected(route: str, question: str, t0: float):
+    elapsed = time.perf_counter() - t0
+    CLIENT_DISCONNECTS.inc(route=route)
+    REQUEST_SECONDS.observe(elapsed, route=route, status="disconnected")
+    print(f"[{route.lstrip('/')}] question={question[:50]}... client disconnected after {elapsed:.2f}s; work cancelled", flush=True)
+
 
 def handle_question(func):
     @wraps(func)
@@ -49,14 +95,52 @@ def handle_question(func):
         if data is not None:
             question = data.get("question")
             memory = data.get("memory", [])
+            deadline = data.get("deadline")
+            session_id = data.get("session_id")
+            new_session = data.get("session", False)
         else:
             question = None
             memory = []
+            deadline = None
+            session_id = None
+            new_session = False
 
         if not question:
             return jsonify({"error": "No question provided"}), 400
+        # Optional time budget in seconds; the server default (COW_REQUEST_DEADLINE) is the ceiling
+        if deadline is not None:
+            try:
+                deadline = float(deadline)
+            except (TypeError, ValueError):
+                return jsonify({"error": "deadline must be a number of seconds"}), 400
+        # Optional server-side conversation: "session": true starts one, and the response carries the server-generated
+        # session_id the client sends (with only the new question) on later turns
+        if session_id is not None and (not isinstance(session_id, str) or not 0 < len(session_id) <= 128):
+            return jsonify({"error": "session_id must be a non-empty string of at most 128 characters"}), 400
+        if not isinstance(new_session, bool):
+            return jsonify({"error": "session must be true or false"}), 400
+
+        return await func(question, memory, deadline, session_id, new_session, *args, **kwargs)
+
+    return wrapper
+
+
+def _rejected(e: AdmissionRejected):
+    return jsonify({"error": e.message}), e.status, {"Retry-After": str(e.retry_after)}
 
-        return await func(question, memory, *args, **kwargs)
+
+def admitted(func):
+    """Run the handler only once admission control grants a slot."""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            release = await admission.acquire()
+        except AdmissionRejected as e:
+            return _rejected(e)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            release()
 
     return wrapper
 
@@ -73,13 +157,51 @@ async def health_check():
     return jsonify({"status": "healthy", "service": "chat-api"}), 200
 
 
+def _collect_component_stats():
+    stats = {"gemini_executor": gemini_executor_stats()}
+    pipeline = current_pipeline()
+    if pipeline is not None:
+        stats.update(pipeline.stats())
+    sessions = current_session_store()
+    if sessions is not None:
+        stats["sessions"] = sessions.stats()
+    for component, values in stats.items():
+        for stat, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                COMPONENT_STATS.set(value, component=component, stat=stat)
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    _collect_component_stats()
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
 @app.route("/predict", methods=["POST"])
 @handle_question
-async def predict(question, memory):
+@admitted
+async def predict(question, memory, deadline, session_id, new_session):
     t0 = time.perf_counter()
     verbose = os.getenv("COW_VERBOSE", "").strip().lower() in ("1", "true", "yes")
-    result = await process_question(question, memory, verbose=verbose)
+    try:
+        with start_trace(
+            "predict",
+            route="/predict",
+            question=question[:500],
+            memory_turns=len(memory),
+            session=session_id is not None or new_session,
+        ) as trace:
+            result = await process_question(
+                question, memory, verbose=verbose, deadline=deadline, session_id=session_id, new_session=new_session
+            )
+            trace.set(error=result.get("error"), n_urls=len(result.get("data", {}).get("url_supporting") or []))
+    except asyncio.CancelledError:
+        # Quart cancels the handler when the client disconnects; the cancellation reaches the pipeline's
+        # tasks and queued LLM calls, so no more work is spent on an answer nobody will read
+        _disconnected("/predict", question, t0)
+        raise
     elapsed = time.perf_counter() - t0
+    REQUEST_SECONDS.observe(elapsed, route="/predict", status="error" if result.get("error") else "ok")
     if result.get("error"):
         print(f"[predict] question={question[:50]}... error in {elapsed:.2f}s: {result.get('error', '')[:60]}", flush=True)
         return jsonify(result), 503
@@ -87,5 +209,62 @@ async def predict(question, memory):
     return jsonify(result), 200
 
 
+@app.route("/predict/stream", methods=["POST"])
+@handle_question
+async def predict_stream(question, memory, deadline, session_id, new_session):
+    """Server-sent events: retrieval/references stage events, answer tokens, then done (or error)."""
+    verbose = os.getenv("COW_VERBOSE", "").strip().lower() in ("1", "true", "yes")
+
+    async def events():
+        t0 = time.perf_counter()
+        # The slot is taken once the body starts streaming, inside this generator, so a client that disconnects
+        # before the body is iterated never holds one (an unstarted generator's finally never runs)
+        try:
+            release = await admission.acquire()
+        except AdmissionRejected as e:
+            data = {"error": e.message, "status": e.status, "retry_after": e.retry_after}
+            yield f"event: error\ndata: {json.dumps(data)}\n\n".encode()
+            return
+        first_token = None
+        status = "ok"
+        try:
+            with start_trace(
+                "predict",
+                route="/predict/stream",
+                question=question[:500],
+                memory_turns=len(memory),
+                session=session_id is not None or new_session,
+            ) as trace:
+                async for event, data in stream_question(
+                    question, memory, verbose=verbose, deadline=deadline, session_id=session_id, new_session=new_session
+                ):
+                    if event == "token" and first_token is None:
+                        first_token = time.perf_counter() - t0
+                        FIRST_TOKEN_SECONDS.observe(first_token)
+                        trace.set(first_token_ms=round(first_token * 1000, 1))
+                    elif event == "error":
+                        status = "error"
+                        trace.set(error=data.get("error"))
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client went away mid-stream: closing this generator closes stream_question, which cancels the
+            # answer task and stops the Gemini stream
+            _disconnected("/predict/stream", question, t0)
+            raise
+        finally:
+            release()
+        REQUEST_SECONDS.observe(time.perf_counter() - t0, route="/predict/stream", status=status)
+        ttft = f"{first_token:.2f}s" if first_token is not None else "n/a"
+        print(f"[predict/stream] question={question[:50]}... done in {time.perf_counter() - t0:.2f}s (first token {ttft})", flush=True)
+
+    response = await make_response(
+        events(),
+        200,
+        {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.timeout = None
+    return response
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8000)
@@ -1,8 +1,9 @@
 """
 CoW Protocol RAG: docs + Order Book API. No Optimism/OP code.
-CoW-only RAG: config, documents, build_faiss, process_question (uses rag_brains).
+CoW-only RAG: config, documents, build_faiss, pipeline, process_question (uses rag_brains).
 """
-from cow_brains.process_question import process_question
+from cow_brains.process_question import process_question, stream_question
+from cow_brains.pipeline import CowPipeline, get_pipeline
 from cow_brains.config import (
     SCOPE,
     CHAT_MODEL,
@@ -14,6 +15,9 @@ from cow_brains.config import (
 
 __all__ = [
     "process_question",
+    "stream_question",
+    "CowPipeline",
+    "get_pipeline",
     "SCOPE",
     "CHAT_MODEL",
     "EMBEDDING_MODEL",
@@ -2,9 +2,12 @@
 import asyncio
 import os
 
-from cow_brains.config import COW_FAISS_PATH, EMBEDDING_MODEL
+from cow_brains.config import COW_EMBEDDING_CACHE_PATH, COW_FAISS_PATH, EMBEDDING_MODEL
 from cow_brains.data_exporter import DataExporter
+from cow_brains.pipeline import ALL_BOOST_QUERIES, RETRIEVER_K, build_router
 from rag_brains.chat.apis import access_APIs
+from rag_brains.chat.embedding_cache import EmbeddingCache
+from rag_brains.retriever.faiss_retriever import FaissRetriever
 from langchain_community.vectorstores import FAISS
 
 
@@ -17,13 +20,23 @@ async def main():
         return
 
     print(f"Embedding {len(documents)} chunks...")
-    embeddings = access_APIs.get_embedding(EMBEDDING_MODEL)
+    cache = EmbeddingCache(maxsize=0, path=COW_EMBEDDING_CACHE_PATH or None)
+    embeddings = access_APIs.get_embedding(EMBEDDING_MODEL, cache=cache)
     db = FAISS.from_documents(documents, embeddings)
+    stats = cache.stats()
+    print(f"Embedding cache: {stats['hits']} reused, {stats['misses']} embedded")
 
     os.makedirs(COW_FAISS_PATH, exist_ok=True)
     db.save_local(COW_FAISS_PATH)
     print(f"Saved FAISS index to {COW_FAISS_PATH}")
 
+    print(f"Precomputing {len(ALL_BOOST_QUERIES)} boost queries...")
+    retriever = FaissRetriever(db, k=RETRIEVER_K, index_path=COW_FAISS_PATH)
+    retriever.precompute(ALL_BOOST_QUERIES)
+
+    print("Computing query router centroids...")
+    build_router(retriever)
+
 
 if __name__ == "__main__":
     asyncio.run(main())
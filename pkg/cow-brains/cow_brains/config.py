@@ -44,3 +44,53 @@ if not COW_OPENAPI_PATH or not os.path.isfile(COW_OPENAPI_PATH):
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "gemini-embedding-001")
 CHAT_MODEL = os.getenv("CHAT_MODEL", "gemini-2.0-flash")
 SCOPE = "CoW Protocol / Order Book API / Integration / docs.cow.fi"
+
+# Exact-match answer cache (first-turn questions only). Size 0 disables; set a path to persist across restarts.
+ANSWER_CACHE_SIZE = int(os.getenv("COW_ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("COW_ANSWER_CACHE_TTL", str(6 * 60 * 60)))
+ANSWER_CACHE_PATH = os.getenv("COW_ANSWER_CACHE_PATH", "").strip()
+
+# Semantic answer cache: reuse the answer of a previous first-turn question when cosine similarity >= threshold.
+# Off by default (size 0): the threshold is not yet validated against a labelled set of paraphrases, and a false
+# match serves another question's answer. COW_SEMANTIC_CACHE_SIZE=1024 is a reasonable size to turn it on.
+SEMANTIC_CACHE_SIZE = int(os.getenv("COW_SEMANTIC_CACHE_SIZE", "0"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("COW_SEMANTIC_CACHE_THRESHOLD", "0.93"))
+SEMANTIC_CACHE_TTL = float(os.getenv("COW_SEMANTIC_CACHE_TTL", str(6 * 60 * 60)))
+
+# On-disk embedding cache used by build_faiss: unchanged chunks are not re-embedded on rebuild
+COW_EMBEDDING_CACHE_PATH = os.getenv(
+    "COW_EMBEDDING_CACHE_PATH", os.getenv("EMBEDDING_CACHE_PATH", "") or os.path.join(BASE_PATH, "cow-docs", "embedding_cache")
+)
+if COW_EMBEDDING_CACHE_PATH and not os.path.isabs(COW_EMBEDDING_CACHE_PATH):
+    COW_EMBEDDING_CACHE_PATH = os.path.abspath(COW_EMBEDDING_CACHE_PATH)
+
+# Local query router: skip the preprocessor LLM for plain first-turn questions, reject clearly off-topic ones.
+# Off by default: the margins are not yet validated against a labelled question set, and a false off-topic match
+# refuses a legitimate question without asking the LLM.
+QUERY_ROUTER = os.getenv("COW_QUERY_ROUTER", "0").strip().lower() not in ("0", "false", "no", "")
+ROUTER_OFF_TOPIC_MARGIN = float(os.getenv("COW_ROUTER_OFF_TOPIC_MARGIN", "0.08"))
+ROUTER_IN_SCOPE_MARGIN = float(os.getenv("COW_ROUTER_IN_SCOPE_MARGIN", "0.02"))
+
+# Default time budget (seconds) of a prediction request; clients may ask for less. 0 disables.
+REQUEST_DEADLINE = float(os.getenv("COW_REQUEST_DEADLINE", "45"))
+
+# Responder context budget in estimated tokens (~4 chars each); 0 disables. Chunks longer than the per-chunk
+# cap are cut at a markdown section boundary.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("COW_CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_CHUNK_MAX_TOKENS = int(os.getenv("COW_CONTEXT_CHUNK_MAX_TOKENS", "1500"))
+
+# Query-aware extractive compression of long docs fragments before packing (no LLM call); off by default
+CONTEXT_COMPRESSION = os.getenv("COW_CONTEXT_COMPRESSION", "0").strip().lower() in ("1", "true", "yes")
+CONTEXT_COMPRESSION_TOKENS = int(os.getenv("COW_CONTEXT_COMPRESSION_TOKENS", "400"))
+
+# Conversation memory sent to the LLMs: the last COW_MEMORY_TURNS turns (user message + reply) verbatim, older ones
+# in a rolling summary of at most COW_MEMORY_SUMMARY_TOKENS, everything capped at COW_MEMORY_MAX_TOKENS (0 = send all)
+MEMORY_TURNS = int(os.getenv("COW_MEMORY_TURNS", "3"))
+MEMORY_MAX_TOKENS = int(os.getenv("COW_MEMORY_MAX_TOKENS", "1500"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("COW_MEMORY_SUMMARY_TOKENS", "400"))
+
+# Server-side sessions (optional session_id on /predict): in-process LRU size, idle TTL (seconds), and memory
+# entries kept per session
+SESSION_MAX = int(os.getenv("COW_SESSION_MAX", "10000"))
+SESSION_TTL = float(os.getenv("COW_SESSION_TTL", str(24 * 60 * 60)))
+SESSION_MAX_ENTRIES = int(os.getenv("COW_SESSION_MAX_ENTRIES", "100"))
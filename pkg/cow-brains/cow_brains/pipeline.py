@@ -0,0 +1,524 @@
+"""
+Long-lived CoW RAG pipeline.
+
+The FAISS retriever, the LLM adapters (inside RAGSystem) and the DataExporter snapshot are built once
+per process (see cow_app.api startup) and shared by every request. Per-request state (memory, reasoning
+history, retrieved contexts) lives only in the call to CowPipeline.answer / RAGSystem.predict.
+"""
+from typing import Dict, Any, AsyncIterator, Callable, List, Optional, Tuple
+import asyncio
+import functools
+import hashlib
+import math
+import time
+
+from cow_core import deadline
+from cow_core.tracing import current_span
+from rag_brains.cache import AnswerCache, SemanticAnswerCache
+from rag_brains.chat import model_utils
+from rag_brains.chat.compression import ExtractiveCompressor
+from rag_brains.chat.memory import MemoryManager
+from rag_brains.chat.router import DEFAULT_OFF_TOPIC_SEEDS, QueryRouter, seeds_hash
+from rag_brains.chat.system_structure import RAGSystem
+from rag_brains.chat.utils import normalize_answer_text
+from rag_brains.metrics import STAGE_SECONDS
+from rag_brains.retriever import connect_faiss
+from rag_brains.singleflight import SingleFlight
+from cow_brains.config import (
+    CHAT_MODEL,
+    SCOPE,
+    COW_FAISS_PATH,
+    EMBEDDING_MODEL,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_PATH,
+    SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL,
+    QUERY_ROUTER,
+    ROUTER_OFF_TOPIC_MARGIN,
+    ROUTER_IN_SCOPE_MARGIN,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_CHUNK_MAX_TOKENS,
+    CONTEXT_COMPRESSION,
+    CONTEXT_COMPRESSION_TOKENS,
+    MEMORY_TURNS,
+    MEMORY_MAX_TOKENS,
+    MEMORY_SUMMARY_TOKENS,
+)
+from cow_brains.data_exporter import DataExporter
+from cow_brains.prompts import COW_RESPONDER_EXTRA
+
+CHAT_MODEL_PARAMS = {"temperature": 0.0, "max_retries": 5, "max_tokens": 1024, "timeout": 60}
+
+# Boosts: one primary by topic (first match wins); for order/quote/slippage always add SDK so we have best dev solution
+BOOST_TOPICS: List[Tuple[Tuple[str, ...], Tuple[str, ...]]] = [
+    (
+        ("approval", "approve", "abi", "gasless", "allowance", "vault relayer"),
+        ("GPv2VaultRelayer token allowance approval ERC-20 gasless",),
+    ),
+    (
+        ("insufficientbalance", "insufficient allowance", "error type", "what does", "how do i fix", "orderposterror"),
+        ("OrderPostError InsufficientBalance order validation error 400",),
+    ),
+    (
+        ("buyamount", "slippage", "creating an order", "order creation", "sellamount"),
+        (
+            "POST /api/v1/quote OrderQuoteSide buyAmount sellAmount order parameters",
+            "CoW SDK TypeScript getQuote order signing OrderBookApi trading",
+        ),
+    ),
+    (
+        ("cow swap", "cowswap", "widget", "frontend", "embed", "swap ui", "swap interface"),
+        ("CoW Swap frontend widget embed monorepo apps",),
+    ),
+    (
+        ("sdk", "cow-sdk", "typescript", " ts ", "javascript", "getquote", "orderbookapi", "order signing"),
+        ("CoW SDK TypeScript getQuote order signing OrderBookApi trading",),
+    ),
+]
+SDK_ORDER_BOOST = "TradingSdk getQuote postSwapOrderFromQuote ViemAdapter create order"
+MAX_BOOSTS = 3  # cap at 3 to include TradingSdk when relevant
+# Boost strings are fixed, so their top-k results are precomputed per index version (see FaissRetriever.warm)
+ALL_BOOST_QUERIES: List[str] = list(dict.fromkeys(
+    [q for _, queries in BOOST_TOPICS for q in queries] + [SDK_ORDER_BOOST]
+))
+RETRIEVER_K = 8
+
+# Example in-scope queries for the router's in-scope centroid (blended with the index centroid)
+ROUTER_IN_SCOPE_SEEDS: List[str] = ALL_BOOST_QUERIES + [
+    "How do I create an order on CoW Protocol?",
+    "What is a CoW and how does batch auction settlement work?",
+    "How do solvers compete in CoW Protocol?",
+    "How do I get a quote from the Order Book API?",
+    "What is MEV protection in CoW Swap?",
+    "How do I cancel an order?",
+    "What are programmatic orders and CoW Hooks?",
+    "Which networks does CoW Protocol support?",
+]
+ROUTER_OFF_TOPIC_ANSWER = (
+    f"I'm sorry, but I can only answer questions about {SCOPE}. "
+    f"Is there anything specific about {SCOPE} you'd like to know?"
+)
+
+
+def transform_memory_entries(entries: List[Dict[str, str]]) -> List[Tuple[str, str]]:
+    return [(e["name"], e["message"]) for e in entries if "message" in e]
+
+
+# Width (seconds) of the request-deadline buckets that single-flight callers are grouped by
+DEADLINE_BUCKET = 5.0
+
+
+def _deadline_bucket() -> str:
+    left = deadline.remaining()
+    if left is None:
+        return "none"
+    return str(int(math.ceil(max(left, 0.0) / DEADLINE_BUCKET)))
+
+
+def boost_queries(q: str) -> List[str]:
+    """Fixed boost queries to search in addition to q, based on its topic."""
+    q_lower = (q or "").lower()
+    boosts = []
+    for terms, queries in BOOST_TOPICS:
+        if any(t in q_lower for t in terms):
+            boosts.extend(queries)
+            break
+    if any(t in q_lower for t in ("order", "create")) and any(t in q_lower for t in ("sdk", "cow-sdk")):
+        boosts.append(SDK_ORDER_BOOST)
+    return boosts[:MAX_BOOSTS]
+
+
+def router_version(index_version: str) -> str:
+    return f"{index_version}:{seeds_hash(ROUTER_IN_SCOPE_SEEDS, DEFAULT_OFF_TOPIC_SEEDS)}"
+
+
+def pipeline_fingerprint(index_version: str) -> str:
+    """Changes with the index, the models, the CoW prompt or the context budget, so cached answers never outlive
+    them."""
+    compression = CONTEXT_COMPRESSION_TOKENS if CONTEXT_COMPRESSION else 0
+    prompt_config = f"{COW_RESPONDER_EXTRA}|{CONTEXT_TOKEN_BUDGET}|{CONTEXT_CHUNK_MAX_TOKENS}|{compression}"
+    prompt_hash = hashlib.sha256(prompt_config.encode()).hexdigest()[:8]
+    return f"{index_version}:{CHAT_MODEL}:{EMBEDDING_MODEL}:{prompt_hash}"
+
+
+def router_kwargs() -> Dict[str, Any]:
+    return {
+        "off_topic_answer": ROUTER_OFF_TOPIC_ANSWER,
+        "off_topic_margin": ROUTER_OFF_TOPIC_MARGIN,
+        "in_scope_margin": ROUTER_IN_SCOPE_MARGIN,
+    }
+
+
+def build_router(retriever) -> QueryRouter:
+    """Compute the router centroids for a FaissRetriever (blocking) and store them next to the index."""
+    router = QueryRouter.build(
+        retriever.db,
+        retriever.embed_queries,
+        in_scope_seeds=ROUTER_IN_SCOPE_SEEDS,
+        version=router_version(retriever.index_version),
+        **router_kwargs(),
+    )
+    try:
+        router.save(retriever.index_path)
+    except OSError as e:
+        print(f"[query_router] could not store centroids: {e}", flush=True)
+    return router
+
+
+def load_router(retriever) -> QueryRouter:
+    """Stored router for the retriever's index version, computing it if missing or stale (blocking)."""
+    router = QueryRouter.load(retriever.index_path, router_version(retriever.index_version), **router_kwargs())
+    return router if router is not None else build_router(retriever)
+
+
+def merge_contexts(primary: list, extra: list, max_total: int = 10) -> list:
+    """Merge two context lists by URL, keeping order of primary then extra, deduped."""
+    seen_urls = set()
+    out = []
+    for doc_list in (primary, extra):
+        for doc in doc_list:
+            meta = getattr(doc, "metadata", None) or {}
+            url = meta.get("url") or getattr(doc, "url", None)
+            key = url or id(doc)
+            if key not in seen_urls:
+                seen_urls.add(key)
+                out.append(doc)
+                if len(out) >= max_total:
+                    return out
+    return out
+
+
+async def preprocessor(llm, **kwargs):
+    out = await model_utils.Prompt.apreprocessor(llm, scope=SCOPE, **kwargs)
+    # Limit expansion to reduce retriever calls and latency
+    if out and out.get("needs_info") and out.get("expansion"):
+        exp = out["expansion"]
+        if exp.get("questions"):
+            exp["questions"] = exp["questions"][:2]
+        if exp.get("keywords"):
+            exp["keywords"] = exp["keywords"][:2]
+    return out
+
+
+async def responder(llm, final=False, **kwargs):
+    return await model_utils.Prompt.aresponder(
+        llm, final=final, scope=SCOPE, responder_extra=COW_RESPONDER_EXTRA, **kwargs
+    )
+
+
+class CowPipeline:
+    """Process-wide RAG pipeline. Build with `await CowPipeline.create()` (or get_pipeline()) and reuse."""
+
+    def __init__(
+        self,
+        default_retriever,
+        contexts_df,
+        answer_cache: Optional[AnswerCache] = None,
+        semantic_cache: Optional[SemanticAnswerCache] = None,
+        query_router: Optional[QueryRouter] = None,
+    ):
+        self.default_retriever = default_retriever
+        self.contexts_df = contexts_df
+        self._contexts_loaded_at = time.time()
+        self.answer_cache = answer_cache
+        self.semantic_cache = semantic_cache
+        self.query_router = query_router
+        # Identical questions in flight at the same time share one pipeline run
+        self.flights = SingleFlight()
+        self.memory_manager = None
+        if MEMORY_MAX_TOKENS > 0:
+            self.memory_manager = MemoryManager(
+                keep_turns=MEMORY_TURNS, max_tokens=MEMORY_MAX_TOKENS, summary_tokens=MEMORY_SUMMARY_TOKENS
+            )
+        self.fingerprint = pipeline_fingerprint(default_retriever.index_version)
+        compression = CONTEXT_COMPRESSION_TOKENS if CONTEXT_COMPRESSION else 0
+        self.rag_model = RAGSystem(
+            reasoning_limit=1,
+            models_to_use=[(CHAT_MODEL, CHAT_MODEL_PARAMS), (CHAT_MODEL, CHAT_MODEL_PARAMS)],
+            retriever=self.retrieve,
+            batch_retriever=self.retrieve_batch,
+            query_router=self.route if query_router is not None else None,
+            context_filter=functools.partial(
+                model_utils.ContextHandling.filter,
+                token_budget=CONTEXT_TOKEN_BUDGET,
+                max_chunk_tokens=CONTEXT_CHUNK_MAX_TOKENS or None,
+                compressor=ExtractiveCompressor(max_tokens=compression) if compression else None,
+            ),
+            system_prompt_preprocessor=preprocessor,
+            system_prompt_responder=responder,
+        )
+
+    @classmethod
+    async def create(cls) -> "CowPipeline":
+        with STAGE_SECONDS.time(stage="data_exporter_refresh"):
+            contexts_df = await DataExporter.get_dataframe(only_not_embedded=False)
+        default_retriever = await model_utils.RetrieverBuilder.build_faiss_retriever(
+            faiss_path=COW_FAISS_PATH,
+            embedding_model=EMBEDDING_MODEL,
+            k=RETRIEVER_K,
+        )
+        await default_retriever.warm(ALL_BOOST_QUERIES)
+        answer_cache = None
+        if ANSWER_CACHE_SIZE > 0:
+            answer_cache = await asyncio.to_thread(
+                AnswerCache, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_PATH or None
+            )
+        # index_version hashes the index files; compute it off the event loop
+        await asyncio.to_thread(lambda: default_retriever.index_version)
+        semantic_cache = None
+        if SEMANTIC_CACHE_SIZE > 0:
+            semantic_cache = SemanticAnswerCache(
+                threshold=SEMANTIC_CACHE_THRESHOLD,
+                maxsize=SEMANTIC_CACHE_SIZE,
+                version=pipeline_fingerprint(default_retriever.index_version),
+                ttl=SEMANTIC_CACHE_TTL,
+            )
+        query_router = None
+        if QUERY_ROUTER:
+            try:
+                query_router = await asyncio.to_thread(load_router, default_retriever)
+            except Exception as e:
+                # Without a router every question goes through the preprocessor LLM
+                print(f"[query_router] disabled: {e}", flush=True)
+        return cls(
+            default_retriever,
+            contexts_df,
+            answer_cache=answer_cache,
+            semantic_cache=semantic_cache,
+            query_router=query_router,
+        )
+
+    async def refresh_contexts(self):
+        """Return the DataExporter snapshot, reloading it only once DataExporter.CACHE_TTL has passed."""
+        if time.time() - self._contexts_loaded_at > DataExporter.CACHE_TTL:
+            with STAGE_SECONDS.time(stage="data_exporter_refresh"):
+                self.contexts_df = await DataExporter.get_dataframe(only_not_embedded=False)
+            self._contexts_loaded_at = time.time()
+            await self._check_index_version()
+        return self.contexts_df
+
+    async def _check_index_version(self):
+        """Drop semantic-cache answers if the index files on disk no longer match the version they were made with."""
+        path = self.default_retriever.index_path
+        if self.semantic_cache is None or not path:
+            return
+        try:
+            on_disk = await asyncio.to_thread(connect_faiss.index_version, path)
+        except OSError as e:
+            print(f"[semantic_cache] could not read index version: {e}", flush=True)
+            return
+        if on_disk != self.default_retriever.index_version:
+            # The loaded index still serves requests until restart; answers cached before the rebuild are dropped
+            print("[semantic_cache] index files changed on disk; cache cleared (restart to serve the new index)", flush=True)
+            self.semantic_cache.ensure_version(pipeline_fingerprint(on_disk))
+
+    @staticmethod
+    def search_plan(query: dict, reasoning_level: int) -> Tuple[List[str], bool]:
+        """Search strings for one retriever query, and whether the first search alone is enough when non-empty.
+
+        keyword (level 0) -> the keyword; question (level 0) -> the question, falling back to question + boosts
+        if empty; question (level >= 1) or raw query -> query + its boosts.
+        """
+        if reasoning_level < 1 and "keyword" in query:
+            return [query["keyword"]], True
+        if "question" in query:
+            q = query["question"]
+            return [q] + boost_queries(q), reasoning_level < 1
+        if "query" in query:
+            q = query["query"]
+            return [q] + boost_queries(q), False
+        return [], False
+
+    async def retrieve_batch(self, queries: List[dict], reasoning_level: int) -> List[list]:
+        """Retrieve for all queries of a reasoning level with one embedding call and one FAISS search."""
+        plans = [self.search_plan(q, reasoning_level) for q in queries]
+        # First wave: everything except boosts for searches that only need them when empty
+        wave = list(dict.fromkeys(
+            t for terms, first_only in plans for t in (terms[:1] if first_only else terms)
+        ))
+        found = dict(zip(wave, await self.default_retriever.search_many(wave)))
+        missing = [
+            t for terms, first_only in plans
+            if first_only and terms and not found[terms[0]]
+            for t in terms[1:] if t not in found
+        ]
+        if missing:
+            missing = list(dict.fromkeys(missing))
+            found.update(zip(missing, await self.default_retriever.search_many(missing)))
+
+        results = []
+        for terms, first_only in plans:
+            if not terms:
+                results.append([])
+                continue
+            main_ctx = found[terms[0]]
+            if first_only and len(main_ctx) > 0:
+                results.append(main_ctx)
+                continue
+            for boost in terms[1:]:
+                main_ctx = merge_contexts(main_ctx, found[boost])
+            results.append(main_ctx)
+        return results
+
+    async def retrieve(self, query: dict, reasoning_level: int) -> list:
+        return (await self.retrieve_batch([query], reasoning_level))[0]
+
+    async def route(self, query: str, memory: list):
+        """RAGSystem query_router: decide locally for first-turn questions (None = ask the preprocessor LLM)."""
+        if memory:
+            return None
+        # Usually an embedding cache hit: the semantic cache embedded the same question just before
+        vector = (await asyncio.to_thread(self.default_retriever.embed_queries, [query]))[0]
+        return self.query_router.route(query, vector, memory)
+
+    async def answer(
+        self,
+        question: str,
+        memory: List[Dict[str, str]],
+        verbose: bool = False,
+        emit: Optional[Callable[[str, dict], None]] = None,
+    ) -> Dict[str, Any]:
+        if emit is not None:
+            # Stage events belong to one caller, so streamed requests run on their own
+            return await self._answer(question, memory, verbose=verbose, emit=emit)
+        # The shared run inherits the first caller's deadline, so only callers with about the same time budget
+        # share one (a 0.1s caller must not cut short a 40s one)
+        key = f"{AnswerCache.make_key(question, memory, self.fingerprint)}:{_deadline_bucket()}"
+        return await self.flights.do(key, lambda: self._answer(question, memory, verbose=verbose))
+
+    async def _answer(
+        self,
+        question: str,
+        memory: List[Dict[str, str]],
+        verbose: bool = False,
+        emit: Optional[Callable[[str, dict], None]] = None,
+    ) -> Dict[str, Any]:
+        # Answers depend on the conversation, so only first-turn questions use the cache
+        cache_key = None
+        if self.answer_cache is not None and not memory:
+            cache_key = AnswerCache.make_key(question, memory, self.fingerprint)
+            cached = self.answer_cache.get(cache_key)
+            if cached is not None:
+                current_span().set(cache="exact")
+                return cached
+        question_vector = None
+        if self.semantic_cache is not None and not memory:
+            try:
+                question_vector = (await asyncio.to_thread(self.default_retriever.embed_queries, [question]))[0]
+            except Exception as e:
+                # The cache is an optimization; answer normally if the embedding call fails
+                print(f"[semantic_cache] embedding failed: {e}", flush=True)
+            if question_vector is not None:
+                similar = self.semantic_cache.lookup(question_vector)
+                if similar is not None:
+                    current_span().set(cache="semantic", cache_similarity=round(similar[1], 4))
+                    return similar[0]
+
+        contexts_df = await self.refresh_contexts()
+        formatted_memory = transform_memory_entries(memory)
+        if self.memory_manager is not None and formatted_memory:
+            formatted_memory = self.memory_manager.compact(formatted_memory)
+            current_span().set(
+                memory_entries=len(memory), memory_tokens=MemoryManager.tokens(formatted_memory)
+            )
+        result = await self.rag_model.apredict(
+            question, contexts_df, memory=formatted_memory, verbose=verbose, emit=emit
+        )
+        current_span().set(
+            cache="miss", routed=result.get("routed"), fallback=result.get("fallback"),
+            deadline_exceeded=bool(result.get("deadline_exceeded")),
+            reasoning_levels=len(result.get("reasoning") or {}),
+        )
+        answer_data = result["answer"]
+        raw_answer = answer_data.get("answer") or ""
+        out = {
+            "data": {
+                "answer": normalize_answer_text(raw_answer),
+                "url_supporting": answer_data.get("url_supporting") or [],
+            },
+            "error": None,
+            # Set when the answer is a stand-in (deadline hit, or no answer could be generated), so callers such as
+            # sessions do not keep it as a real turn
+            "fallback": bool(result.get("fallback")),
+            "deadline_exceeded": bool(result.get("deadline_exceeded")),
+        }
+        if not result.get("fallback"):
+            if cache_key is not None:
+                await asyncio.to_thread(self.answer_cache.set, cache_key, out)
+            if question_vector is not None:
+                self.semantic_cache.add(question_vector, out)
+        return out
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Counters of the caches, single-flight and embedder, keyed by component (exported at /metrics)."""
+        out: Dict[str, Dict[str, Any]] = {
+            "single_flight": {
+                "executions": self.flights.executions,
+                "shared": self.flights.shared,
+                "abandoned": self.flights.abandoned,
+                "in_flight": self.flights.in_flight(),
+            },
+        }
+        if self.memory_manager is not None:
+            out["memory"] = self.memory_manager.stats()
+        if self.answer_cache is not None:
+            out["answer_cache"] = self.answer_cache.stats()
+        if self.semantic_cache is not None:
+            out["semantic_cache"] = self.semantic_cache.stats()
+        embedder_stats = getattr(self.default_retriever.db.embedding_function, "stats", None)
+        if callable(embedder_stats):
+            out.update(embedder_stats())
+        return out
+
+    async def stream(
+        self,
+        question: str,
+        memory: List[Dict[str, str]],
+        verbose: bool = False,
+    ) -> AsyncIterator[Tuple[str, dict]]:
+        """Yield (event, data) pairs: stage events and answer tokens, then
+        ("done", {answer, url_supporting, fallback, deadline_exceeded}).
+
+        Token events carry the raw answer text as generated; the "done" answer is the final one
+        (citations renumbered, whitespace normalized) and should replace what was streamed.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def emit(event: str, data: dict):
+            queue.put_nowait((event, data))
+
+        task = asyncio.create_task(self.answer(question, memory, verbose=verbose, emit=emit))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (item := await queue.get()) is not None:
+                yield item
+            result = task.result()
+            yield "done", {
+                **result["data"],
+                "fallback": bool(result.get("fallback")),
+                "deadline_exceeded": bool(result.get("deadline_exceeded")),
+            }
+        finally:
+            if not task.done():
+                task.cancel()
+
+
+_pipeline: Optional[CowPipeline] = None
+_pipeline_lock = asyncio.Lock()
+
+
+def current_pipeline() -> Optional[CowPipeline]:
+    """The process-wide pipeline if it has been built, without building it."""
+    return _pipeline
+
+
+async def get_pipeline() -> CowPipeline:
+    """Return the process-wide pipeline, building it on first use."""
+    global _pipeline
+    if _pipeline is None:
+        async with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = await CowPipeline.create()
+    return _pipeline
@@ -0,0 +1,165 @@
+"""
+Server-side conversation sessions: with a session_id, clients send only the new question and the server keeps the
+conversation memory.
+
+Session ids are generated here (uuid4) and handed to the client on the first turn; a client never picks one, so
+knowing another user's id requires having seen it. An unknown or expired id starts a new session with a new id.
+
+Sessions live behind SessionBackend (get/put/delete of a JSON-serializable dict), so a shared store (e.g. Redis)
+can replace the default InMemorySessionBackend, a per-process LRU with TTL. Turns of one session run one at a
+time, so concurrent requests on the same session never lose each other's turns.
+"""
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import copy
+import threading
+import time
+import uuid
+import weakref
+
+from cow_brains.config import SESSION_MAX, SESSION_TTL, SESSION_MAX_ENTRIES
+
+
+class SessionBackend:
+    """Storage interface for sessions; values are dicts like {"memory": [{"name": ..., "message": ...}]}."""
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def put(self, session_id: str, session: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InMemorySessionBackend(SessionBackend):
+    """Bounded in-process store: least recently used sessions are evicted past maxsize, idle ones after ttl."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 24 * 60 * 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[session_id]
+                    self.evicted += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    async def put(self, session_id: str, session: Dict[str, Any]):
+        with self._lock:
+            self._entries[session_id] = (time.time(), copy.deepcopy(session))
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    async def delete(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+            }
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class Session:
+    """One turn's view of a session: memory to answer with, and add_turn() to record the answer."""
+
+    def __init__(self, session_id: str, memory: List[Dict[str, str]], max_entries: int, changed: bool = False):
+        self.id = session_id
+        self.memory = memory
+        self.max_entries = max_entries
+        # New sessions are saved even without a turn, so the id handed to the client exists
+        self.changed = changed
+
+    def add_turn(self, question: str, answer: str):
+        self.memory = (self.memory + [{"name": "user", "message": question}, {"name": "chat", "message": answer}])[
+            -self.max_entries:
+        ]
+        self.changed = True
+
+
+class SessionStore:
+    def __init__(self, backend: SessionBackend, max_entries: int = 100):
+        self.backend = backend
+        # Memory entries kept per session; older ones are dropped (the pipeline summarizes what it sends anyway)
+        self.max_entries = max_entries
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    @asynccontextmanager
+    async def turn(
+        self, session_id: Optional[str] = None, memory: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[Session]:
+        """Load the session, yield it, save it if changed.
+
+        Without session_id, or if it is unknown or expired, a new session with a generated id starts from `memory`
+        (if the client sent any); the client must send that session.id on later turns.
+        """
+        if session_id is not None:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = self._locks[session_id] = asyncio.Lock()
+            async with lock:
+                stored = await self.backend.get(session_id)
+                if stored is not None:
+                    session = Session(session_id, stored.get("memory") or [], self.max_entries)
+                    yield session
+                    if session.changed:
+                        await self.backend.put(session.id, {"memory": session.memory})
+                    return
+        # Nobody else knows a fresh id yet, so the new session needs no lock
+        session = Session(new_session_id(), list(memory or [])[-self.max_entries:], self.max_entries, changed=True)
+        yield session
+        await self.backend.put(session.id, {"memory": session.memory})
+
+    def stats(self) -> Dict[str, Any]:
+        return self.backend.stats()
+
+
+_store: Optional[SessionStore] = None
+
+
+def get_session_store() -> SessionStore:
+    """Process-wide store (in-memory backend from config) unless set_session_backend() installed another."""
+    global _store
+    if _store is None:
+        _store = SessionStore(InMemorySessionBackend(SESSION_MAX, SESSION_TTL), SESSION_MAX_ENTRIES)
+    return _store
+
+
+def set_session_backend(backend: SessionBackend):
+    global _store
+    _store = SessionStore(backend, SESSION_MAX_ENTRIES)
+
+
+def current_session_store() -> Optional[SessionStore]:
+    """The store if any session was used (for /metrics), without creating one."""
+    return _store
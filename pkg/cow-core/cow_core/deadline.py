@@ -0,0 +1,65 @@
+"""
+Per-request deadline carried in a contextvar, so every layer (pipeline, retriever, LLM adapters) can cap its
+own timeouts to the time the request has left.
+
+    with deadline_scope(20.0):
+        ...
+        timeout = cap_timeout(60)   # <= remaining time; raises DeadlineExceeded once it has passed
+
+Nested scopes can only shorten the deadline. Context is copied into asyncio tasks and asyncio.to_thread
+calls; plain executor threads must be given the value explicitly.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+import time
+
+_deadline: ContextVar[Optional[float]] = ContextVar("cow_request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out."""
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[Optional[float]]:
+    """Set the deadline to now + seconds (or keep an earlier one). None or <= 0 leaves it unchanged."""
+    if seconds is None or seconds <= 0:
+        yield _deadline.get()
+        return
+    new = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(new if current is None else min(current, new))
+    try:
+        yield _deadline.get()
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            pass
+
+
+def deadline() -> Optional[float]:
+    """The current deadline as a time.monotonic() value, or None."""
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the deadline (may be negative), or None without a deadline."""
+    d = _deadline.get()
+    return None if d is None else d - time.monotonic()
+
+
+def expired() -> bool:
+    r = remaining()
+    return r is not None and r <= 0
+
+
+def cap_timeout(timeout: float) -> float:
+    """timeout, shortened to the remaining time; raises DeadlineExceeded if none is left."""
+    r = remaining()
+    if r is None:
+        return timeout
+    if r <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(timeout, r)
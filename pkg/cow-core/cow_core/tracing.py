@@ -0,0 +1,250 @@
+"""
+Lightweight request tracing: spans kept in a contextvar, whole traces written as JSON lines by a background
+thread to a size-rotated file.
+
+    with start_trace("predict", question=q):
+        with span("retrieve", level=0) as s:
+            ...
+            s.set(urls=urls)
+
+Configuration (environment):
+- COW_TRACE_PATH: JSONL file to write; empty disables tracing.
+- COW_TRACE_SAMPLE_RATE: fraction of traces kept (default 1.0).
+- COW_TRACE_MAX_BYTES / COW_TRACE_BACKUPS: rotation size (default 50 MB) and number of old files kept (5).
+
+Spans opened outside a sampled trace are no-ops, so instrumented code never needs to check. Context is
+copied into asyncio tasks and asyncio.to_thread calls, so spans opened there nest correctly.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+
+class Span:
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.trace = trace
+        self.id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = dict(attrs)
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+
+    def to_dict(self) -> Dict[str, Any]:
+        out = {
+            "id": self.id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.start - self.trace.root.start) * 1000, 3),
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "attrs": self.attrs,
+        }
+        if self.error:
+            out["error"] = self.error
+        return out
+
+
+class _NullSpan:
+    id = None
+
+    def set(self, **attrs):
+        pass
+
+    def end(self):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.wall_start = time.time()
+        self._lock = threading.Lock()
+        self.spans: List[Span] = []
+        self.root = Span(self, name, None, attrs)
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [s.to_dict() for s in self.spans]
+        root = self.root.to_dict()
+        return {
+            "trace_id": self.id,
+            "span_id": root["id"],
+            "name": root["name"],
+            "timestamp": self.wall_start,
+            "duration_ms": root["duration_ms"],
+            "attrs": root["attrs"],
+            "error": root.get("error"),
+            "spans": spans,
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("cow_trace_span", default=None)
+
+
+class JsonlTraceWriter:
+    """Appends one JSON object per line from a daemon thread; rotates at max_bytes (path -> path.1 -> ...)."""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backups: int = 5, max_pending: int = 10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self.written = 0
+        # Counters are updated from request threads (write) and the writer thread
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_pending)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, record: Dict[str, Any]):
+        """Never blocks: records are dropped (and counted) when the writer falls behind."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"written": self.written, "dropped": self.dropped}
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 256:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    self._rotate()
+                with open(self.path, "a") as f:
+                    for record in batch:
+                        f.write(json.dumps(record, default=str) + "\n")
+                with self._lock:
+                    self.written += len(batch)
+            except OSError as e:
+                with self._lock:
+                    self.dropped += len(batch)
+                print(f"[tracing] could not write traces to {self.path}: {e}", flush=True)
+
+
+_writer: Optional[JsonlTraceWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> Optional[JsonlTraceWriter]:
+    """Writer configured from COW_TRACE_PATH, or None when tracing is disabled."""
+    global _writer
+    path = os.getenv("COW_TRACE_PATH", "").strip()
+    if not path:
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = JsonlTraceWriter(
+                    path,
+                    max_bytes=int(os.getenv("COW_TRACE_MAX_BYTES", str(50 * 1024 * 1024))),
+                    backups=int(os.getenv("COW_TRACE_BACKUPS", "5")),
+                )
+    return _writer
+
+
+def _sample_rate() -> float:
+    try:
+        return float(os.getenv("COW_TRACE_SAMPLE_RATE", "1.0"))
+    except ValueError:
+        return 1.0
+
+
+def _reset(token):
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Closed from another context (e.g. an async generator finalized elsewhere); nothing to restore
+        pass
+
+
+@contextmanager
+def start_trace(name: str, **attrs) -> Iterator[Span]:
+    """Root span of a request; the finished trace is queued for the JSONL writer if sampled."""
+    writer = get_writer()
+    if writer is None or random.random() >= _sample_rate():
+        yield NULL_SPAN
+        return
+    trace = Trace(name, attrs)
+    token = _current_span.set(trace.root)
+    try:
+        yield trace.root
+    except BaseException as e:
+        trace.root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _reset(token)
+        trace.root.end()
+        writer.write(trace.to_dict())
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    """Child of the current span; a no-op outside a sampled trace."""
+    parent = _current_span.get()
+    if parent is None:
+        yield NULL_SPAN
+        return
+    child = Span(parent.trace, name, parent.id, attrs)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _reset(token)
+        child.end()
+        parent.trace.add(child)
+
+
+def current_span():
+    """The innermost open span (NULL_SPAN outside a trace), e.g. to attach attributes."""
+    return _current_span.get() or NULL_SPAN
+
+
+def current_trace_id() -> Optional[str]:
+    s = _current_span.get()
+    return s.trace.id if s is not None else None
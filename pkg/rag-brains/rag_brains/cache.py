@@ -0,0 +1,254 @@
+"""
+Answer caches for the RAG pipeline:
+- AnswerCache: exact match on the normalized question (LRU + TTL, optional SQLite store).
+- SemanticAnswerCache: nearest previously answered question by embedding similarity (in-memory FAISS).
+"""
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import copy
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import faiss
+import numpy as np
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivial variants share a key."""
+    return _WS_RE.sub(" ", (question or "").strip().lower()).rstrip(" ?!.")
+
+
+def memory_hash(memory: List[Dict[str, str]] | None) -> str:
+    return hashlib.sha256(json.dumps(memory or [], sort_keys=True).encode()).hexdigest()[:16]
+
+
+class AnswerCache:
+    """Exact-match answer cache with LRU + TTL eviction and an optional SQLite store that survives restarts.
+
+    Keys come from make_key(question, memory, fingerprint); the fingerprint should change whenever the
+    index or models change so stale answers are never served.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 6 * 60 * 60, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._open(path)
+
+    @staticmethod
+    def make_key(question: str, memory: List[Dict[str, str]] | None, fingerprint: str) -> str:
+        raw = json.dumps([normalize_question(question), memory_hash(memory), fingerprint])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _open(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, created REAL NOT NULL, value TEXT NOT NULL)"
+        )
+        cutoff = time.time() - self.ttl
+        self._db.execute("DELETE FROM answers WHERE created < ?", (cutoff,))
+        rows = self._db.execute(
+            "SELECT key, created, value FROM answers ORDER BY created DESC LIMIT ?", (self.maxsize,)
+        ).fetchall()
+        self._db.commit()
+        # Oldest first so the most recent rows end up at the MRU end
+        for key, created, value in reversed(rows):
+            self._entries[key] = (created, json.loads(value))
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            created, value = entry
+            if time.time() - created > self.ttl:
+                self._delete(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(value)
+
+    def set(self, key: str, value: dict):
+        created = time.time()
+        with self._lock:
+            self._entries[key] = (created, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.maxsize:
+                evicted.append(self._entries.popitem(last=False)[0])
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO answers (key, created, value) VALUES (?, ?, ?)",
+                    (key, created, json.dumps(value)),
+                )
+                self._db.executemany("DELETE FROM answers WHERE key = ?", [(k,) for k in evicted])
+                self._db.commit()
+
+    def _delete(self, key: str):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM answers WHERE key = ?", (key,))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+# Nearest entries checked per lookup, so expired neighbours do not hide a live match behind them
+_SEARCH_K = 4
+
+
+class SemanticAnswerCache:
+    """Answers of previously answered questions, returned for new questions whose embedding is close enough.
+
+    Vectors must come from the same embedding model as the FAISS index. Similarity is cosine (vectors are
+    L2-normalized into an inner-product index). `version` is the index/model fingerprint the answers were
+    made with: ensure_version() drops every entry when it changes. Entries expire after ttl like AnswerCache's,
+    and the oldest ones are evicted in batches once maxsize is reached.
+    """
+
+    def __init__(self, threshold: float = 0.93, maxsize: int = 1024, version: str = "", ttl: float = 6 * 60 * 60):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.version = version
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._index: Optional[faiss.IndexFlatIP] = None
+        self._vectors: List[np.ndarray] = []
+        self._values: List[dict] = []
+        self._created: List[float] = []
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.array(vector, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(v)
+        return v
+
+    def ensure_version(self, version: str):
+        """Invalidate every entry if the index/model fingerprint changed."""
+        with self._lock:
+            if version != self.version:
+                self._clear()
+                self.version = version
+                self.invalidations += 1
+
+    def _clear(self):
+        self._index = None
+        self._vectors = []
+        self._values = []
+        self._created = []
+
+    def _rebuild(self):
+        if not self._vectors:
+            self._index = None
+            return
+        self._index = faiss.IndexFlatIP(self._vectors[0].shape[1])
+        self._index.add(np.vstack(self._vectors))
+
+    def _drop_oldest(self, n: int):
+        self._vectors = self._vectors[n:]
+        self._values = self._values[n:]
+        self._created = self._created[n:]
+
+    def _drop_expired(self, now: float):
+        """Drop expired entries (the oldest ones: entries are kept in insertion order); the caller rebuilds."""
+        cutoff = now - self.ttl
+        n = 0
+        while n < len(self._created) and self._created[n] < cutoff:
+            n += 1
+        self._drop_oldest(n)
+        self.expired += n
+
+    def _search(self, v: np.ndarray, now: float) -> Tuple[Optional[Tuple[dict, float]], bool]:
+        """Closest unexpired entry above threshold among the nearest few, and whether an expired one was passed."""
+        scores, indices = self._index.search(v, min(self._index.ntotal, _SEARCH_K))
+        passed_expired = False
+        for score, i in zip(scores[0], indices[0]):
+            score, i = float(score), int(i)
+            if i < 0 or score < self.threshold:
+                break
+            if now - self._created[i] > self.ttl:
+                passed_expired = True
+                continue
+            return (copy.deepcopy(self._values[i]), score), passed_expired
+        return None, passed_expired
+
+    def lookup(self, vector) -> Optional[Tuple[dict, float]]:
+        """Return (cached value, similarity) of the closest unexpired entry above threshold, else None."""
+        v = self._normalize(vector)
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0 or self._index.d != v.shape[1]:
+                self.misses += 1
+                return None
+            now = time.time()
+            found, passed_expired = self._search(v, now)
+            if passed_expired:
+                # Expired entries stay in the index until a lookup runs into one, then go all at once
+                self._drop_expired(now)
+                self._rebuild()
+                if found is None and self._index is not None:
+                    # More than _SEARCH_K expired neighbours may have hidden a live match
+                    found, _ = self._search(v, now)
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return found
+
+    def add(self, vector, value: dict):
+        v = self._normalize(vector)
+        with self._lock:
+            if self._vectors and self._vectors[0].shape[1] != v.shape[1]:
+                self._clear()
+            now = time.time()
+            self._vectors.append(v)
+            self._values.append(copy.deepcopy(value))
+            self._created.append(now)
+            if len(self._vectors) > self.maxsize:
+                # Evict the oldest 10% at once (and anything expired) so the index is not rebuilt on every insert
+                self._drop_oldest(max(1, self.maxsize // 10))
+                self._drop_expired(now)
+                self._rebuild()
+            elif self._index is None:
+                self._rebuild()
+            else:
+                self._index.add(v)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._values),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "expired": self.expired,
+                "threshold": self.threshold,
+            }
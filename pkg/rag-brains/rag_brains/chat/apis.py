@@ -5,6 +5,8 @@ from langchain_community.embeddings import HuggingFaceEmbeddings
 from rag_brains.config import (
     EMBEDDING_MODEL,
     CHAT_MODEL,
+    EMBED_COALESCE_MS,
+    EMBED_COALESCE_BATCH,
 )
 
 
@@ -36,5 +38,12 @@ class access_APIs:
                 embedding_model = f"models/{model}"
             else:
                 embedding_model = "models/gemini-embedding-001"
+            if "cache" not in kwargs:
+                from .embedding_cache import get_embedding_cache
+                kwargs["cache"] = get_embedding_cache()
+            kwargs.setdefault("coalesce_ms", EMBED_COALESCE_MS)
+            kwargs.setdefault("coalesce_batch", EMBED_COALESCE_BATCH)
             return GeminiEmbeddings(model=embedding_model, **kwargs)
+        for key in ("cache", "coalesce_ms", "coalesce_batch"):
+            kwargs.pop(key, None)
         return OpenAIEmbeddings(model=model, **kwargs)
@@ -0,0 +1,128 @@
+"""
+Query-aware extractive compression of retrieved chunks, without an LLM call.
+
+A chunk is split into blocks (headings, fenced code blocks, sentences); sentences and code blocks are scored by
+IDF-weighted overlap with the query and the expansion questions, and the best ones are kept, in their original
+order, up to a per-chunk token budget. Headings are always kept so the model still sees where text comes from.
+
+    compressor = ExtractiveCompressor(max_tokens=400)
+    text = compressor(doc, [query, *questions])
+"""
+from typing import List, Sequence, Set, Tuple
+import math
+import re
+
+from .context_packing import estimate_tokens
+
+_FENCE = re.compile(r"^(```|~~~).*?^\1[^\n]*$", re.S | re.M)
+_HEADING = re.compile(r"^#{1,6} ")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9`\"'(\[])")
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+_GAP = "\n[...]\n"
+
+_STOPWORDS = frozenset(
+    """a an the and or but if then else of to in on at by for with from as is are was were be been being it its
+    this that these those what which who whom how why when where can could should would will do does did not no
+    i you he she we they me my your our their there here about into over under than so such any all some""".split()
+)
+
+# Block kinds; SENTENCE continues the line of the block before it, TEXT starts a new line
+HEADING, CODE, TEXT, SENTENCE = "heading", "code", "text", "sentence"
+
+
+def _terms(text: str) -> Set[str]:
+    return {w for w in (m.lower() for m in _WORD.findall(text)) if w not in _STOPWORDS and len(w) > 1}
+
+
+def split_blocks(text: str) -> List[Tuple[str, str]]:
+    """(kind, text) blocks in document order: headings, whole fenced code blocks, and sentences (one line of
+    prose is a TEXT block followed by SENTENCE blocks)."""
+    blocks: List[Tuple[str, str]] = []
+    pos = 0
+    for fence in _FENCE.finditer(text):
+        blocks.extend(_split_prose(text[pos:fence.start()]))
+        blocks.append((CODE, fence.group(0)))
+        pos = fence.end()
+    blocks.extend(_split_prose(text[pos:]))
+    return blocks
+
+
+def _split_prose(text: str) -> List[Tuple[str, str]]:
+    out = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if _HEADING.match(line):
+            out.append((HEADING, line))
+            continue
+        sentences = [s for s in _SENTENCE_END.split(line) if s.strip()]
+        out.extend((TEXT if j == 0 else SENTENCE, s) for j, s in enumerate(sentences))
+    return out
+
+
+class ExtractiveCompressor:
+    """Callable compressor for ContextHandling.filter: (doc, queries) -> text to send for that doc.
+
+    Only documents whose metadata type_db_info is in `types` are compressed; chunks already under
+    `min_tokens` are returned as-is.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 400,
+        min_tokens: int = 250,
+        types: Sequence[str] = ("docs_fragment",),
+    ):
+        self.max_tokens = max_tokens
+        self.min_tokens = max(min_tokens, max_tokens)
+        self.types = frozenset(types)
+
+    def __call__(self, doc, queries: Sequence[str]) -> str:
+        text = doc.page_content or ""
+        if doc.metadata.get("type_db_info") not in self.types or estimate_tokens(text) <= self.min_tokens:
+            return text
+        return self.compress(text, queries)
+
+    def compress(self, text: str, queries: Sequence[str]) -> str:
+        blocks = split_blocks(text)
+        query_terms = _terms(" ".join(q for q in queries if q))
+        if not blocks or not query_terms:
+            return text
+        block_terms = [_terms(b) for _, b in blocks]
+        # Terms rare within the chunk say more about which part of it the question is about
+        df = {t: sum(t in bt for bt in block_terms) for t in query_terms}
+        weights = {t: math.log(1 + len(blocks) / n) for t, n in df.items() if n}
+
+        def score(i: int) -> float:
+            return sum(weights.get(t, 0.0) for t in block_terms[i] & query_terms)
+
+        keep = {i for i, (kind, _) in enumerate(blocks) if kind == HEADING}
+        used = sum(estimate_tokens(blocks[i][1]) for i in keep)
+        candidates = [(score(i), kind == CODE, i) for i, (kind, _) in enumerate(blocks) if kind != HEADING]
+        # Best-scoring spans first; among equal scores, code blocks (examples) before prose
+        for s, is_code, i in sorted(candidates, key=lambda c: (-c[0], not c[1], c[2])):
+            if s <= 0 and not is_code:
+                break
+            cost = estimate_tokens(blocks[i][1])
+            if used + cost > self.max_tokens:
+                continue
+            keep.add(i)
+            used += cost
+        if len(keep) == len(blocks):
+            return text
+        return self._join(blocks, keep)
+
+    @staticmethod
+    def _join(blocks: List[Tuple[str, str]], keep: Set[int]) -> str:
+        out: List[str] = []
+        last = -1
+        for i in sorted(keep):
+            kind, block = blocks[i]
+            if out and i != last + 1:
+                out.append(_GAP)
+            elif out:
+                out.append(" " if kind == SENTENCE else "\n")
+            out.append(block)
+            last = i
+        return "".join(out).strip()
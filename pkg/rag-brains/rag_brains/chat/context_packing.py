@@ -0,0 +1,82 @@
+"""
+Token-budgeted context packing: fit the highest-ranked retrieved chunks into a fixed prompt budget.
+
+Tokens are estimated from characters (about 4 per token for English text and code), which is close enough to
+bound the responder prompt without a tokenizer call per chunk. Oversized chunks are cut at a markdown section
+boundary (a heading, else a paragraph break) so the model never sees half a sentence of an unrelated section.
+"""
+from typing import Iterable, List, Optional, Tuple
+import re
+
+CHARS_PER_TOKEN = 4
+# Chunks cut shorter than this are dropped rather than sent as a stub
+MIN_TRUNCATED_TOKENS = 120
+# Template/wrapper tokens added around each chunk by ContextHandling.format
+CHUNK_OVERHEAD_TOKENS = 20
+TRUNCATION_MARK = "\n[...]"
+
+_HEADING = re.compile(r"\n(?=#{1,6} )")
+_PARAGRAPH = re.compile(r"\n\s*\n")
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_markdown(text: str, max_tokens: int) -> str:
+    """text cut to about max_tokens, at the last heading (else paragraph, else line) boundary that fits."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARK), 0)
+    head = text[:limit]
+    # Prefer the latest boundary that still keeps at least half of the allowed text
+    for pattern in (_HEADING, _PARAGRAPH):
+        cuts = [m.start() for m in pattern.finditer(head) if m.start() >= limit // 2]
+        if cuts:
+            return head[: cuts[-1]].rstrip() + TRUNCATION_MARK
+    cut = head.rfind("\n")
+    if cut >= limit // 2:
+        head = head[:cut]
+    return head.rstrip() + TRUNCATION_MARK
+
+
+class PackResult:
+    def __init__(self):
+        self.items: List[Tuple[object, str]] = []
+        self.tokens = 0
+        self.truncated = 0
+        self.dropped = 0
+
+
+def pack(
+    ranked: Iterable[Tuple[object, str]],
+    token_budget: Optional[int],
+    max_chunk_tokens: Optional[int] = None,
+) -> PackResult:
+    """Keep (item, text) pairs in rank order while they fit in token_budget.
+
+    A chunk over max_chunk_tokens is truncated first; a chunk that does not fit in what is left of the budget
+    is truncated to the remainder, or dropped if that would leave less than MIN_TRUNCATED_TOKENS. Later,
+    smaller chunks may still fit after a drop. token_budget None (or <= 0) keeps everything.
+    """
+    result = PackResult()
+    unlimited = not token_budget or token_budget <= 0
+    for item, text in ranked:
+        text = text or ""
+        cut = False
+        if max_chunk_tokens and estimate_tokens(text) > max_chunk_tokens:
+            text, cut = truncate_markdown(text, max_chunk_tokens), True
+        cost = estimate_tokens(text) + CHUNK_OVERHEAD_TOKENS
+        if not unlimited:
+            left = token_budget - result.tokens
+            if cost > left:
+                room = left - CHUNK_OVERHEAD_TOKENS
+                if room < MIN_TRUNCATED_TOKENS:
+                    result.dropped += 1
+                    continue
+                text, cut = truncate_markdown(text, room), True
+                cost = estimate_tokens(text) + CHUNK_OVERHEAD_TOKENS
+        result.items.append((item, text))
+        result.tokens += cost
+        result.truncated += cut
+    return result
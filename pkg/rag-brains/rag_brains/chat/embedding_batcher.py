@@ -0,0 +1,126 @@
+"""
+Coalesces embedding calls from concurrent requests into batched API calls.
+
+Callers (retriever threads) submit texts and block on a future; a collector thread gathers submissions
+for up to `window_ms` or until `max_batch` texts are queued, then one embed call serves them all and the
+vectors are fanned back out. Calls that are already large enough skip the queue.
+
+Flush threads do not inherit the callers' deadline contextvar, so each submission carries its caller's absolute
+deadline and a flush runs under the latest one in its batch: the API call may run as long as some caller still
+waits, and no longer.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import queue
+import threading
+import time
+
+from cow_core.deadline import (
+    DeadlineExceeded,
+    deadline as current_deadline,
+    deadline_scope,
+    remaining as deadline_remaining,
+)
+
+Vector = List[float]
+# (texts, future, caller's deadline as a time.monotonic() value or None)
+Submission = Tuple[List[str], Future, Optional[float]]
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[Vector]],
+        window_ms: float = 5.0,
+        max_batch: int = 100,
+        max_inflight: int = 4,
+    ):
+        self._embed_fn = embed_fn
+        self.window = max(window_ms, 0.0) / 1000.0
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Submission]" = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+        # Flushes run here so the collector keeps gathering while a batch is in flight
+        self._pool = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="embed-batch")
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.api_calls = 0
+        self.texts = 0
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._collect, name="embed-coalescer", daemon=True)
+                    self._thread.start()
+
+    def embed(self, texts: Sequence[str]) -> List[Vector]:
+        """Blocking: vectors for texts (in order), possibly computed together with other callers' texts."""
+        texts = list(texts)
+        if not texts:
+            return []
+        with self._stats_lock:
+            self.requests += 1
+        if self.window <= 0 or len(texts) >= self.max_batch:
+            return self._call(texts)
+        future: Future = Future()
+        self._ensure_thread()
+        self._queue.put((texts, future, current_deadline()))
+        # Wait no longer than the caller's request deadline; the batch still completes for the others
+        left = deadline_remaining()
+        try:
+            return future.result(timeout=None if left is None else max(left, 0))
+        except FuturesTimeoutError:
+            raise DeadlineExceeded("Request deadline exceeded while waiting for embeddings")
+
+    async def aembed(self, texts: Sequence[str]) -> List[Vector]:
+        return await asyncio.to_thread(self.embed, texts)
+
+    def _call(self, texts: List[str]) -> List[Vector]:
+        with self._stats_lock:
+            self.api_calls += 1
+            self.texts += len(texts)
+        return self._embed_fn(texts)
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.window
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._pool.submit(self._flush, batch)
+
+    def _flush(self, batch: List[Submission]):
+        unique = list(dict.fromkeys(t for texts, _, _ in batch for t in texts))
+        deadlines = [d for _, _, d in batch]
+        # A caller without a deadline waits indefinitely, so only a batch of deadline-bound callers is capped
+        left = None if None in deadlines else max(deadlines) - time.monotonic()
+        try:
+            if left is not None and left <= 0:
+                raise DeadlineExceeded("Request deadline exceeded before the embedding batch was sent")
+            with deadline_scope(left):
+                vectors = self._call(unique)
+            if len(vectors) != len(unique):
+                raise ValueError(f"Embedding API returned {len(vectors)} vectors for {len(unique)} texts")
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        by_text = dict(zip(unique, vectors))
+        for texts, future, _ in batch:
+            future.set_result([by_text[t] for t in texts])
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {"requests": self.requests, "api_calls": self.api_calls, "texts": self.texts}
@@ -0,0 +1,183 @@
+"""
+Content-addressed embedding cache used by GeminiEmbeddings.
+
+Key = sha256(model + text). Lookups hit an in-process LRU first, then an optional on-disk store: one
+directory per model with `vectors.f32` (float32 rows, memory-mapped for reads, append-only) and `keys.tsv`
+(`<key>\t<row>` lines). Appends take an exclusive file lock, so several workers can share one store.
+Vectors are stored exactly as the API returned them, so an index built from cached vectors is byte-identical
+to one built from fresh API calls.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from rag_brains.config import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH
+
+
+_DTYPE = np.float32
+_ITEMSIZE = np.dtype(_DTYPE).itemsize
+
+
+def embedding_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{text}".encode()).hexdigest()
+
+
+class _DiskStore:
+    """Append-only float32 vectors for one model, read through np.memmap."""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._keys_path = os.path.join(directory, "keys.tsv")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self.dim: Optional[int] = None
+        if os.path.isfile(self._meta_path):
+            with open(self._meta_path) as f:
+                self.dim = json.load(f).get("dim")
+        self._rows: Dict[str, int] = {}
+        self._keys_offset = 0
+        self._mmap: Optional[np.memmap] = None
+        self._mmap_rows = 0
+        self._read_new_keys()
+
+    def _read_new_keys(self):
+        """Pick up keys appended since the last read (possibly by another process)."""
+        if not os.path.isfile(self._keys_path):
+            return
+        with open(self._keys_path) as f:
+            f.seek(self._keys_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # partially written line; read it next time
+                self._keys_offset += len(line.encode())
+                key, _, row = line.rstrip("\n").partition("\t")
+                if row.isdigit():
+                    self._rows[key] = int(row)
+
+    def _matrix(self, min_rows: int) -> Optional[np.memmap]:
+        if self._mmap is None or self._mmap_rows < min_rows:
+            n = os.path.getsize(self._vectors_path) // (_ITEMSIZE * self.dim) if os.path.isfile(self._vectors_path) else 0
+            if n == 0:
+                return None
+            self._mmap = np.memmap(self._vectors_path, dtype=_DTYPE, mode="r", shape=(n, self.dim))
+            self._mmap_rows = n
+        return self._mmap
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        if row is None:
+            self._read_new_keys()
+            row = self._rows.get(key)
+        if row is None or self.dim is None:
+            return None
+        matrix = self._matrix(row + 1)
+        if matrix is None or row >= matrix.shape[0]:
+            return None
+        return np.array(matrix[row], dtype=np.float32)
+
+    def put_many(self, keys: Sequence[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=_DTYPE)
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            with open(self._meta_path, "w") as f:
+                json.dump({"dim": self.dim}, f)
+        if vectors.shape[1] != self.dim:
+            return
+        with open(self._keys_path, "a") as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                with open(self._vectors_path, "ab") as vf:
+                    start = vf.tell() // (_ITEMSIZE * self.dim)
+                    vf.write(vectors.tobytes())
+                lines = "".join(f"{k}\t{start + i}\n" for i, k in enumerate(keys))
+                keys_file.write(lines)
+                keys_file.flush()
+            finally:
+                fcntl.flock(keys_file, fcntl.LOCK_UN)
+        for i, k in enumerate(keys):
+            self._rows[k] = start + i
+
+
+class EmbeddingCache:
+    """LRU of embedding vectors keyed by (model, text hash), optionally backed by a float32 on-disk store."""
+
+    def __init__(self, maxsize: int = 4096, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._stores: Dict[str, _DiskStore] = {}
+        self._lock = threading.Lock()
+
+    def _store(self, model: str) -> Optional[_DiskStore]:
+        if not self.path:
+            return None
+        if model not in self._stores:
+            slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+            self._stores[model] = _DiskStore(os.path.join(self.path, slug))
+        return self._stores[model]
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Cached vector (or None) for each text, in order."""
+        out: List[Optional[List[float]]] = []
+        with self._lock:
+            store = self._store(model)
+            for text in texts:
+                key = embedding_key(model, text)
+                vector = self._lru.get(key)
+                if vector is not None:
+                    self._lru.move_to_end(key)
+                elif store is not None:
+                    vector = store.get(key)
+                    if vector is not None:
+                        self._remember(key, vector)
+                if vector is None:
+                    self.misses += 1
+                    out.append(None)
+                else:
+                    self.hits += 1
+                    out.append(vector.tolist())
+        return out
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        if not texts:
+            return
+        keys = [embedding_key(model, t) for t in texts]
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            for key, vector in zip(keys, matrix):
+                self._remember(key, vector)
+            store = self._store(model)
+            if store is not None and matrix.ndim == 2:
+                store.put_many(keys, matrix)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._lru), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+_default_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide cache configured by EMBEDDING_CACHE_SIZE / EMBEDDING_CACHE_PATH."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EmbeddingCache(maxsize=EMBEDDING_CACHE_SIZE, path=EMBEDDING_CACHE_PATH or None)
+    return _default_cache
@@ -1,26 +1,50 @@
 """
 Adapter for Google Gemini (gemini-2.0-flash and embeddings) using the official google-generativeai SDK.
-- Chat: LangChain-compatible with_structured_output(...) and invoke(prompt).
+- Chat: LangChain-compatible with_structured_output(...) and invoke(prompt) / await ainvoke(prompt);
+  astream(prompt) yields the JSON text as it is generated (see parse_text).
 - Embeddings: LangChain-compatible embed_documents / embed_query (same API key).
 One API key from Google AI Studio; set GOOGLE_API_KEY or GEMINI_API_KEY in the environment.
-Note: The deprecated SDK does not support request timeout; we wrap generate_content in a thread timeout.
+Structured output: with GEMINI_NATIVE_SCHEMA the Pydantic schema is compiled (once per class) to Gemini's
+response_schema instead of being pasted into every prompt; a schema the API rejects falls back to the prompt.
+Note: generate_content runs on one shared, size-limited thread pool (GEMINI_MAX_CONCURRENCY). Each call gets
+a per-request SDK timeout and a wait timeout; on timeout the caller returns immediately and the call is
+cancelled if still queued, or abandoned (and ended by the SDK timeout) if already running.
 """
+import asyncio
+import functools
 import json
+import logging
 import os
 import re
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
-from typing import Type, TypeVar, List
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import AsyncIterator, Callable, Dict, Type, TypeVar, List
 
 import google.generativeai as genai
 
+from rag_brains.config import GEMINI_MAX_CONCURRENCY, GEMINI_NATIVE_SCHEMA
+from rag_brains.metrics import (
+    LLM_PARSE_FAILURES,
+    LLM_PROMPT_TOKENS,
+    LLM_RATE_LIMITED,
+    LLM_RETRIES,
+    LLM_TIMEOUTS,
+)
+from cow_core.deadline import cap_timeout, remaining as deadline_remaining
+from cow_core.tracing import span
+
 try:
-    from google.api_core.exceptions import ResourceExhausted
+    from google.api_core.exceptions import BadRequest, ResourceExhausted, DeadlineExceeded
 except ImportError:
+    BadRequest = None  # type: ignore[misc, assignment]
     ResourceExhausted = None  # type: ignore[misc, assignment]
+    DeadlineExceeded = None  # type: ignore[misc, assignment]
 
 T = TypeVar("T")
 
+log = logging.getLogger(__name__)
+
 # Configure once when module is first used for Gemini
 _configured = False
 
@@ -60,6 +84,105 @@ def _schema_to_json_schema(schema_class: Type[T]) -> dict:
     return schema_class.model_json_schema()
 
 
+@functools.lru_cache(maxsize=256)
+def _prompt_schema_suffix(schema_class: Type[T]) -> str:
+    """Schema-in-prompt instructions appended to every prompt when the native schema is not used."""
+    schema_str = json.dumps(_schema_to_json_schema(schema_class), indent=2)
+    return (
+        "\n\nYou must respond with a single valid JSON object (no markdown, no code block) "
+        f"that conforms to this schema:\n{schema_str}\n\n"
+        "Important: Inside any string value, escape double quotes with a backslash (e.g. \\\"). "
+        "For example write \\\"sellToken\\\" not \"sellToken\" inside a string so the JSON stays valid."
+    )
+
+
+# JSON schema keys that Gemini's response_schema (an OpenAPI subset) understands
+_NATIVE_KEYS = ("type", "format", "description", "nullable", "enum", "items", "properties", "required")
+_NATIVE_FORMATS = {"enum", "date-time", "int32", "int64", "float", "double"}
+
+
+def _supports_property_ordering() -> bool:
+    try:
+        return "property_ordering" in genai.protos.Schema.meta.fields
+    except Exception:
+        return False
+
+
+def _compile_native_schema(schema: dict) -> dict:
+    """Pydantic JSON schema -> Gemini response_schema: $refs inlined, anyOf-with-null turned into nullable,
+    title/default and unsupported keys dropped.
+
+    Models here write their instructions as `Field("...")`, which Pydantic puts in `default`; such a default
+    becomes the description and the field is kept required, so the model still sees (and fills) it.
+    """
+    defs = schema.get("$defs") or schema.get("definitions") or {}
+    ordering = _supports_property_ordering()
+
+    def resolve(node: dict, depth: int) -> dict:
+        while "$ref" in node:
+            if depth > 32:
+                raise ValueError("Schema nesting too deep (recursive model?)")
+            target = defs[node["$ref"].rsplit("/", 1)[-1]]
+            node = {**target, **{k: v for k, v in node.items() if k != "$ref"}}
+            depth += 1
+        return node
+
+    def convert(node: dict, depth: int = 0) -> dict:
+        node = resolve(node, depth)
+        nullable = "default" in node and node["default"] is None
+        for key in ("anyOf", "oneOf", "allOf"):
+            if key in node:
+                options = [o for o in node[key] if o.get("type") != "null"]
+                nullable = nullable or len(options) < len(node[key])
+                rest = {k: v for k, v in node.items() if k != key}
+                node = {**resolve(options[0], depth + 1), **rest} if options else {**rest, "type": "string"}
+        if "const" in node:
+            node = {**node, "enum": [node["const"]]}
+        out = {k: node[k] for k in _NATIVE_KEYS if k in node and k not in ("items", "properties")}
+        if "format" in out and out["format"] not in _NATIVE_FORMATS:
+            del out["format"]
+        if "description" not in out and isinstance(node.get("default"), str):
+            out["description"] = node["default"]
+        if "enum" in out:
+            out.setdefault("type", "string")
+            out["format"] = "enum"
+        if nullable:
+            out["nullable"] = True
+        if "items" in node:
+            out["items"] = convert(node["items"], depth + 1)
+        if "properties" in node:
+            props = node["properties"]
+            out["type"] = "object"
+            out["properties"] = {name: convert(prop, depth + 1) for name, prop in props.items()}
+            required = list(node.get("required", []))
+            required += [
+                name for name, prop in props.items()
+                if name not in required and isinstance(resolve(prop, depth).get("default"), str)
+            ]
+            if required:
+                out["required"] = required
+            if ordering:
+                # Keep the declared order (e.g. knowledge_summary before answer) instead of alphabetical
+                out["property_ordering"] = list(props)
+        return out
+
+    return convert(schema)
+
+
+@functools.lru_cache(maxsize=256)
+def _native_schema(schema_class: Type[T]) -> dict | None:
+    """Compiled response_schema for a class, or None if it cannot be expressed natively."""
+    try:
+        return _compile_native_schema(_schema_to_json_schema(schema_class))
+    except Exception as e:
+        log.warning("Could not compile %s to a Gemini response_schema, using schema-in-prompt: %s", schema_class.__name__, e)
+        return None
+
+
+# Classes whose native schema the API rejected; they use schema-in-prompt from then on
+_native_rejected: set = set()
+
+
 def _repair_json_string_quotes(text: str) -> str:
     """Try to fix JSON with unescaped double quotes inside string values (e.g. "sellToken" inside a string -> \\"sellToken\\")."""
     result = []
@@ -104,67 +227,389 @@ def _repair_json_string_quotes(text: str) -> str:
 # Kwargs that belong in GenerationConfig, not in GenerativeModel.__init__
 _GENERATION_KEYS = {"temperature", "max_tokens", "max_retries", "timeout"}
 
+# Retries on 429 (ResourceExhausted) with exponential backoff: 2, 4, 8s
+_MAX_RETRIES = 3
+_BASE_DELAY = 2.0
+
+
+def _is_rate_limited(e: Exception) -> bool:
+    return ResourceExhausted is not None and isinstance(e, ResourceExhausted)
+
+
+def _is_deadline_exceeded(e: Exception) -> bool:
+    return DeadlineExceeded is not None and isinstance(e, DeadlineExceeded)
+
+
+def _is_schema_rejected(e: Exception) -> bool:
+    """The response_schema itself was refused: HTTP 400 (InvalidArgument is a BadRequest), or the SDK could not
+    convert it before sending (TypeError/ValueError/KeyError). Outages, auth errors and timeouts are not."""
+    if BadRequest is not None and isinstance(e, BadRequest):
+        return True
+    return isinstance(e, (TypeError, ValueError, KeyError))
+
+
+def _time_left(end: float) -> dict:
+    """request_options for one attempt of a call that must finish by `end` (time.monotonic())."""
+    return {"timeout": max(end - time.monotonic(), 0.001)}
+
+
+def _check_time_left(end: float, error: Exception):
+    """Before a fallback attempt: give up with the previous attempt's error once the call's time is used up."""
+    if end - time.monotonic() <= 0:
+        raise error
+
+
+def _backoff(attempt: int, deadline: float) -> float:
+    """Backoff before retry `attempt`, or -1 if waiting would overrun the call or request deadline."""
+    delay = min(_BASE_DELAY * (2**attempt), max(deadline - time.monotonic(), 0))
+    left = deadline_remaining()
+    return -1 if left is not None and delay >= left else delay
+
+
+def _usage(response) -> Dict[str, int]:
+    """Prompt/output token counts reported by the API, when present."""
+    meta = getattr(response, "usage_metadata", None)
+    if meta is None:
+        return {}
+    return {
+        "prompt_tokens": getattr(meta, "prompt_token_count", None),
+        "output_tokens": getattr(meta, "candidates_token_count", None),
+    }
+
+
+class _GeminiExecutor:
+    """Shared, size-limited thread pool for blocking Gemini SDK calls, with in-flight/queued/timed-out counters."""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+        self._timed_out = 0
+        self._cancelled = 0
+        self._completed = 0
+
+    def submit(self, fn: Callable, *args) -> Future:
+        with self._lock:
+            self._queued += 1
+
+        def _run():
+            with self._lock:
+                self._queued -= 1
+                self._in_flight += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._completed += 1
+
+        fut = self._pool.submit(_run)
+        fut.add_done_callback(self._on_done)
+        return fut
+
+    def _on_done(self, fut: Future):
+        # A call cancelled while still queued (timeout, or its request went away) never reaches _run
+        if fut.cancelled():
+            with self._lock:
+                self._queued -= 1
+                self._cancelled += 1
+
+    def _record_timeout(self, fut: Future):
+        fut.cancel()
+        with self._lock:
+            self._timed_out += 1
+
+    def run(self, fn: Callable, *args, timeout: float):
+        """Run fn(*args) on the pool and wait at most timeout seconds (no waiting for a hung thread)."""
+        fut = self.submit(fn, *args)
+        try:
+            return fut.result(timeout=timeout)
+        except FuturesTimeoutError:
+            self._record_timeout(fut)
+            raise TimeoutError(f"Gemini call timed out after {timeout}s")
+
+    async def arun(self, fn: Callable, *args, timeout: float):
+        """Async run: awaiting does not block the event loop; cancelling the awaiter cancels a queued call."""
+        fut = self.submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._record_timeout(fut)
+            raise TimeoutError(f"Gemini call timed out after {timeout}s")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "timed_out": self._timed_out,
+                "cancelled": self._cancelled,
+                "completed": self._completed,
+            }
+
+
+_executor = _GeminiExecutor(GEMINI_MAX_CONCURRENCY)
+
+
+def gemini_executor_stats() -> Dict[str, int]:
+    """Counters of the shared Gemini executor: in_flight, queued, timed_out, cancelled, completed."""
+    return _executor.stats()
+
 
 class _StructuredGemini:
-    """Wrapper returned by with_structured_output; has invoke() that returns the Pydantic model instance."""
+    """Wrapper returned by with_structured_output; invoke() / ainvoke() return the Pydantic model instance."""
 
     def __init__(self, model_name: str, schema_class: Type[T], **model_kwargs):
         _ensure_configured()
         gen_config = {k: v for k, v in model_kwargs.items() if k in _GENERATION_KEYS}
         model_only = {k: v for k, v in model_kwargs.items() if k not in _GENERATION_KEYS}
         self._model = genai.GenerativeModel(model_name, **model_only)
+        self._model_name = model_name
         self._schema_class = schema_class
         self._gen_config = gen_config
 
-    def invoke(self, prompt: str) -> T:
-        schema = _schema_to_json_schema(self._schema_class)
-        schema_str = json.dumps(schema, indent=2)
-        full_prompt = (
-            f"{prompt}\n\n"
-            "You must respond with a single valid JSON object (no markdown, no code block) "
-            f"that conforms to this schema:\n{schema_str}\n\n"
-            "Important: Inside any string value, escape double quotes with a backslash (e.g. \\\"). "
-            "For example write \\\"sellToken\\\" not \"sellToken\" inside a string so the JSON stays valid."
+    def _response_schema(self) -> dict | None:
+        """The native response_schema to send, or None to put the schema in the prompt."""
+        if not GEMINI_NATIVE_SCHEMA or self._schema_class in _native_rejected:
+            return None
+        return _native_schema(self._schema_class)
+
+    def _schema_mode(self) -> str:
+        return "native" if self._response_schema() is not None else "prompt"
+
+    def _full_prompt(self, prompt: str) -> str:
+        return prompt + _prompt_schema_suffix(self._schema_class)
+
+    def _config(self, response_schema: dict | None = None):
+        kwargs = {}
+        if response_schema is not None:
+            kwargs["response_schema"] = response_schema
+        return genai.GenerationConfig(
+            response_mime_type="application/json",
+            temperature=self._gen_config.get("temperature", 0.0),
+            max_output_tokens=self._gen_config.get("max_tokens", 1024),
+            **kwargs,
         )
-        timeout_sec = self._gen_config.get("timeout", 60)
-        max_retries = 3
-        base_delay = 2.0
 
-        def _one_call():
+    def _reject_native(self, e: Exception):
+        _native_rejected.add(self._schema_class)
+        log.warning(
+            "Gemini rejected the native response_schema for %s, using schema-in-prompt: %s",
+            self._schema_class.__name__, e,
+        )
+
+    def _one_call(self, prompt: str, timeout: float):
+        # The attempts below share one budget: the caller stops waiting after `timeout`, so fallbacks started
+        # later would only hold an executor slot and spend quota on an answer nobody reads
+        end = time.monotonic() + timeout
+        response_schema = self._response_schema()
+        if response_schema is not None:
             try:
-                config = genai.GenerationConfig(
-                    response_mime_type="application/json",
-                    temperature=self._gen_config.get("temperature", 0.0),
-                    max_output_tokens=self._gen_config.get("max_tokens", 1024),
+                return self._model.generate_content(
+                    prompt, generation_config=self._config(response_schema), request_options=_time_left(end)
                 )
-                return self._model.generate_content(full_prompt, generation_config=config)
-            except Exception:
-                return self._model.generate_content(full_prompt)
-
-        def _generate():
-            last_exc = None
-            for attempt in range(max_retries + 1):
-                try:
-                    return _one_call()
-                except Exception as e:
-                    is_429 = ResourceExhausted is not None and isinstance(e, ResourceExhausted)
-                    if is_429 and attempt < max_retries:
-                        delay = base_delay * (2**attempt)
-                        time.sleep(delay)
-                        last_exc = e
-                        continue
+            except Exception as e:
+                # Only a schema error disables native mode for the class; anything else fails this call only
+                if not _is_schema_rejected(e):
                     raise
-            if last_exc is not None:
-                raise last_exc
+                self._reject_native(e)
+                _check_time_left(end, e)
+        full_prompt = self._full_prompt(prompt)
+        try:
+            return self._model.generate_content(
+                full_prompt, generation_config=self._config(), request_options=_time_left(end)
+            )
+        except Exception as e:
+            # Only fall back to the plain call when the JSON config itself was rejected
+            if _is_rate_limited(e) or _is_deadline_exceeded(e):
+                raise
+            _check_time_left(end, e)
+            return self._model.generate_content(full_prompt, request_options=_time_left(end))
+
+    def _record_usage(self, trace_span, usage: dict, mode: str):
+        trace_span.set(schema_mode=mode, **usage)
+        if mode == "native":
+            trace_span.set(schema_prompt_chars_saved=len(_prompt_schema_suffix(self._schema_class)))
+        if usage.get("prompt_tokens") is not None:
+            LLM_PROMPT_TOKENS.observe(usage["prompt_tokens"], schema_mode=mode)
+
+    def _total_timeout(self) -> float:
         # Allow extra time for 429 retry backoff (e.g. 2+4+8s)
-        total_timeout = timeout_sec + sum(base_delay * (2**i) for i in range(max_retries))
-        with ThreadPoolExecutor(max_workers=1) as ex:
-            fut = ex.submit(_generate)
+        timeout_sec = self._gen_config.get("timeout", 60)
+        return timeout_sec + sum(_BASE_DELAY * (2**i) for i in range(_MAX_RETRIES))
+
+    def invoke(self, prompt: str) -> T:
+        timeout_sec = self._gen_config.get("timeout", 60)
+        total_timeout = self._total_timeout()
+        deadline = time.monotonic() + total_timeout
+        for attempt in range(_MAX_RETRIES + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Gemini generate_content timed out after {total_timeout}s")
+            call_timeout = cap_timeout(min(timeout_sec, remaining))
             try:
-                response = fut.result(timeout=total_timeout)
-            except FuturesTimeoutError:
+                response = _executor.run(self._one_call, prompt, call_timeout, timeout=call_timeout)
+                break
+            except TimeoutError:
+                LLM_TIMEOUTS.inc(call="invoke")
+                raise TimeoutError(f"Gemini generate_content timed out after {call_timeout:.1f}s")
+            except Exception as e:
+                if _is_rate_limited(e):
+                    LLM_RATE_LIMITED.inc(call="invoke")
+                delay = _backoff(attempt, deadline)
+                if _is_rate_limited(e) and attempt < _MAX_RETRIES and delay >= 0:
+                    LLM_RETRIES.inc(call="invoke")
+                    time.sleep(delay)
+                    continue
+                raise
+        usage = _usage(response)
+        if usage.get("prompt_tokens") is not None:
+            LLM_PROMPT_TOKENS.observe(usage["prompt_tokens"], schema_mode=self._schema_mode())
+        return self._parse_response(response)
+
+    async def ainvoke(self, prompt: str) -> T:
+        """Async invoke: the blocking SDK call runs on the shared executor and backoff uses asyncio.sleep, so the event loop stays free."""
+        with span("llm.generate", model=self._model_name, schema=self._schema_class.__name__) as s:
+            response = await self._ainvoke_response(prompt, s)
+            self._record_usage(s, _usage(response), self._schema_mode())
+        return self._parse_response(response)
+
+    async def _ainvoke_response(self, prompt: str, trace_span):
+        trace_span.set(prompt_chars=len(prompt if self._response_schema() is not None else self._full_prompt(prompt)))
+        timeout_sec = self._gen_config.get("timeout", 60)
+        total_timeout = self._total_timeout()
+        deadline = time.monotonic() + total_timeout
+        for attempt in range(_MAX_RETRIES + 1):
+            trace_span.set(retries=attempt)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
                 raise TimeoutError(f"Gemini generate_content timed out after {total_timeout}s")
-        text = (response.text or "").strip()
+            call_timeout = cap_timeout(min(timeout_sec, remaining))
+            try:
+                response = await _executor.arun(self._one_call, prompt, call_timeout, timeout=call_timeout)
+                break
+            except TimeoutError:
+                LLM_TIMEOUTS.inc(call="invoke")
+                raise TimeoutError(f"Gemini generate_content timed out after {call_timeout:.1f}s")
+            except Exception as e:
+                if _is_rate_limited(e):
+                    LLM_RATE_LIMITED.inc(call="invoke")
+                delay = _backoff(attempt, deadline)
+                if _is_rate_limited(e) and attempt < _MAX_RETRIES and delay >= 0:
+                    LLM_RETRIES.inc(call="invoke")
+                    await asyncio.sleep(delay)
+                    continue
+                raise
+        return response
+
+    def _start_stream(self, prompt: str, timeout: float):
+        """Streaming generate_content (the first chunk is fetched here, so a rejected schema fails here)."""
+        end = time.monotonic() + timeout
+        response_schema = self._response_schema()
+        if response_schema is not None:
+            try:
+                return self._model.generate_content(
+                    prompt, generation_config=self._config(response_schema), stream=True, request_options=_time_left(end)
+                )
+            except Exception as e:
+                # Only a schema error disables native mode for the class; anything else fails this call only
+                if not _is_schema_rejected(e):
+                    raise
+                self._reject_native(e)
+                _check_time_left(end, e)
+        return self._model.generate_content(
+            self._full_prompt(prompt), generation_config=self._config(), stream=True, request_options=_time_left(end)
+        )
+
+    def _stream_call(
+        self, prompt: str, timeout: float, emit: Callable[[str], None], stop: threading.Event, usage: dict
+    ):
+        """Blocking streaming generate_content; emits each text chunk until done or stop is set."""
+        response = self._start_stream(prompt, timeout)
+        for chunk in response:
+            if stop.is_set():
+                break
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk without text parts (e.g. only finish_reason)
+                continue
+            if text:
+                emit(text)
+        usage.update(_usage(response))
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """Yield raw JSON text chunks as Gemini produces them; pass the joined text to parse_text() at the end."""
+        with span("llm.stream", model=self._model_name, schema=self._schema_class.__name__) as s:
+            usage: dict = {}
+            async for text in self._astream_chunks(prompt, s, usage):
+                yield text
+            self._record_usage(s, usage, self._schema_mode())
+
+    async def _astream_chunks(self, prompt: str, trace_span, usage: dict) -> AsyncIterator[str]:
+        trace_span.set(prompt_chars=len(prompt if self._response_schema() is not None else self._full_prompt(prompt)))
+        timeout_sec = self._gen_config.get("timeout", 60)
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self._total_timeout()
+        for attempt in range(_MAX_RETRIES + 1):
+            trace_span.set(retries=attempt)
+            queue: asyncio.Queue = asyncio.Queue()
+            stop = threading.Event()
+            done = object()
+
+            def _emit(item):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+
+            # The worker thread does not see the request deadline, so pass the capped timeout explicitly
+            call_timeout = cap_timeout(timeout_sec)
+
+            def _run():
+                try:
+                    self._stream_call(prompt, call_timeout, _emit, stop, usage)
+                finally:
+                    _emit(done)
+
+            fut = _executor.submit(_run)
+            started = False
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    item = await asyncio.wait_for(queue.get(), timeout=cap_timeout(min(timeout_sec, remaining)))
+                    if item is done:
+                        break
+                    started = True
+                    yield item
+                await asyncio.wrap_future(fut)
+                return
+            except asyncio.TimeoutError:
+                _executor._record_timeout(fut)
+                LLM_TIMEOUTS.inc(call="stream")
+                raise TimeoutError(f"Gemini streaming generate_content timed out after {timeout_sec}s")
+            except Exception as e:
+                if _is_rate_limited(e):
+                    LLM_RATE_LIMITED.inc(call="stream")
+                # Retry 429s only before any chunk was yielded
+                delay = _backoff(attempt, deadline)
+                if not started and _is_rate_limited(e) and attempt < _MAX_RETRIES and delay >= 0:
+                    LLM_RETRIES.inc(call="stream")
+                    await asyncio.sleep(delay)
+                    continue
+                raise
+            finally:
+                stop.set()
+                fut.cancel()
+
+    def _parse_response(self, response) -> T:
+        return self.parse_text(response.text or "")
+
+    def parse_text(self, text: str) -> T:
+        """Parse the JSON text of a response into the schema instance (with quote repair and json_repair fallbacks)."""
+        text = (text or "").strip()
         if "```json" in text:
             text = re.sub(r"^```(?:json)?\s*", "", text)
             text = re.sub(r"\s*```$", "", text)
@@ -175,8 +620,7 @@ class _StructuredGemini:
         try:
             data = json.loads(text)
         except json.JSONDecodeError as e:
-            import logging
-            log = logging.getLogger(__name__)
+            LLM_PARSE_FAILURES.inc(schema_mode=self._schema_mode())
             log.warning("Gemini JSON decode failed: %s. Raw (truncated): %s", e, text[:500])
             repaired = _repair_json_string_quotes(text)
             if repaired != text:
@@ -371,9 +815,14 @@ class GeminiChatAdapter:
     def __init__(self, model: str = "gemini-2.0-flash", **kwargs):
         self._model_name = model
         self._kwargs = kwargs
+        # Prompt schema classes are built once (see model_utils.Prompt), so their wrappers can be reused too
+        self._structured: Dict[type, _StructuredGemini] = {}
 
     def with_structured_output(self, schema_class: Type[T]) -> _StructuredGemini:
-        return _StructuredGemini(self._model_name, schema_class, **self._kwargs)
+        structured = self._structured.get(schema_class)
+        if structured is None:
+            structured = self._structured[schema_class] = _StructuredGemini(self._model_name, schema_class, **self._kwargs)
+        return structured
 
 
 def _embedding_to_list(e) -> List[float]:
@@ -384,17 +833,46 @@ def _embedding_to_list(e) -> List[float]:
 
 
 class GeminiEmbeddings:
-    """LangChain-compatible embeddings using Gemini (same API key as chat)."""
-
-    def __init__(self, model: str = "models/gemini-embedding-001", **kwargs):
+    """LangChain-compatible embeddings using Gemini (same API key as chat).
+
+    With a cache (see embedding_cache.EmbeddingCache), only texts not embedded before are sent to the API.
+    With coalesce_ms > 0, API calls from concurrent callers are merged (see embedding_batcher.EmbeddingBatcher).
+    """
+
+    # Max texts per batch embed request
+    BATCH_LIMIT = 100
+
+    def __init__(
+        self,
+        model: str = "models/gemini-embedding-001",
+        cache=None,
+        coalesce_ms: float = 0.0,
+        coalesce_batch: int = BATCH_LIMIT,
+        **kwargs,
+    ):
         _ensure_configured()
         self._model = model if model.startswith("models/") else f"models/{model}"
+        self._cache = cache
         self._kwargs = kwargs
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        if not texts:
-            return []
-        result = genai.embed_content(model=self._model, content=texts, **self._kwargs)
+        self._batcher = None
+        if coalesce_ms > 0:
+            from .embedding_batcher import EmbeddingBatcher
+            self._batcher = EmbeddingBatcher(self._embed, window_ms=coalesce_ms, max_batch=coalesce_batch)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Counters of the embedding cache and the call coalescer, when configured."""
+        out = {}
+        if self._cache is not None:
+            out["embedding_cache"] = self._cache.stats()
+        if self._batcher is not None:
+            out["embedding_batcher"] = self._batcher.stats()
+        return out
+
+    def _embed_batch(self, texts: List[str], timeout: float | None = None) -> List[List[float]]:
+        kwargs = dict(self._kwargs)
+        if timeout is not None:
+            kwargs["request_options"] = {**kwargs.get("request_options", {}), "timeout": timeout}
+        result = genai.embed_content(model=self._model, content=texts, **kwargs)
         if hasattr(result, "embedding") and result.embedding is not None:
             return [_embedding_to_list(result.embedding)]
         if hasattr(result, "embeddings") and result.embeddings:
@@ -404,6 +882,31 @@ class GeminiEmbeddings:
             return [_embedding_to_list(e) for e in (emb if isinstance(emb, list) else [emb])]
         return []
 
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        out = []
+        for i in range(0, len(texts), self.BATCH_LIMIT):
+            # Within a request with a deadline, the API call may not outlive it
+            timeout = cap_timeout(60.0) if deadline_remaining() is not None else None
+            out.extend(self._embed_batch(texts[i : i + self.BATCH_LIMIT], timeout=timeout))
+        return out
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        embed = self._batcher.embed if self._batcher is not None else self._embed
+        if self._cache is None:
+            return embed(list(texts))
+        vectors = self._cache.get_many(self._model, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            fresh = embed(missing)
+            if len(fresh) != len(missing):
+                return self._embed(list(texts))
+            self._cache.put_many(self._model, missing, fresh)
+            by_text = dict(zip(missing, fresh))
+            vectors = [v if v is not None else by_text[t] for t, v in zip(texts, vectors)]
+        return vectors
+
     def embed_query(self, text: str) -> List[float]:
         out = self.embed_documents([text])
         return out[0] if out else []
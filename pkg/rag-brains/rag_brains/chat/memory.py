@@ -0,0 +1,133 @@
+"""
+Conversation-memory compaction: keep the prompt's conversation history bounded however long the chat gets.
+
+The last `keep_turns` turns (a user message and its reply, so 2 * keep_turns entries) are kept verbatim; older entries
+are folded into a rolling extractive summary (the gist of each user message and reply, oldest lines dropped first),
+which is cached by a hash of the conversation prefix it covers, so each new turn folds only the entries that just aged
+out. The result never exceeds `max_tokens`.
+
+    manager = MemoryManager(keep_turns=3, max_tokens=1500)
+    history = manager.compact([("user", "..."), ("chat", "..."), ...])
+    # -> [("summary", "user: ...\\nchat: ..."), ("user", "..."), ...]
+"""
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+import hashlib
+import re
+import threading
+
+from .context_packing import CHARS_PER_TOKEN, estimate_tokens
+
+Entry = Tuple[str, str]
+
+SUMMARY_NAME = "summary"
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _gist(message: str, max_words: int) -> str:
+    """First sentence of a message, cut to max_words."""
+    text = " ".join((message or "").split())
+    first = _SENTENCE_END.split(text, maxsplit=1)[0]
+    words = first.split()
+    return " ".join(words[:max_words]) + (" ..." if len(words) > max_words or first != text else "")
+
+
+def _clip(text: str, max_tokens: int) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[: max(max_tokens * CHARS_PER_TOKEN - 4, 0)].rstrip() + " ..."
+
+
+class MemoryManager:
+    def __init__(
+        self,
+        keep_turns: int = 3,
+        max_tokens: int = 1500,
+        summary_tokens: int = 400,
+        gist_words: int = 30,
+        cache_size: int = 2048,
+    ):
+        self.keep_turns = max(keep_turns, 1)
+        # Memory entries alternate user / chat, so one turn is two entries
+        self.keep_entries = 2 * self.keep_turns
+        self.max_tokens = max_tokens
+        self.summary_tokens = min(summary_tokens, max_tokens)
+        self.gist_words = gist_words
+        self.cache_size = cache_size
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _fold(self, summary: str, entry: Entry) -> str:
+        name, message = entry
+        lines = summary.split("\n") if summary else []
+        lines.append(f"{name}: {_gist(message, self.gist_words)}")
+        # Rolling: the oldest lines go first once the summary is over its budget
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return _clip("\n".join(lines), self.summary_tokens)
+
+    def _summary(self, older: Sequence[Entry]) -> str:
+        """Rolling summary of `older`, reusing the cached summary of its longest already-seen prefix."""
+        prefix_keys: List[str] = []
+        h = hashlib.sha256()
+        for name, message in older:
+            h.update(f"{name}\x00{message}\x01".encode())
+            prefix_keys.append(h.copy().hexdigest())
+        start, summary = 0, ""
+        with self._lock:
+            for i in range(len(prefix_keys) - 1, -1, -1):
+                cached = self._summaries.get(prefix_keys[i])
+                if cached is not None:
+                    self._summaries.move_to_end(prefix_keys[i])
+                    start, summary = i + 1, cached
+                    break
+            # A hit means an earlier turn's summary was reused (only the newly aged-out entries are folded)
+            if start > 0:
+                self.hits += 1
+            else:
+                self.misses += 1
+        for i in range(start, len(older)):
+            summary = self._fold(summary, older[i])
+        if start < len(older):
+            with self._lock:
+                self._summaries[prefix_keys[-1]] = summary
+                while len(self._summaries) > self.cache_size:
+                    self._summaries.popitem(last=False)
+        return summary
+
+    def compact(self, memory: Sequence[Entry]) -> List[Entry]:
+        memory = list(memory)
+        if len(memory) <= self.keep_entries and self.tokens(memory) <= self.max_tokens:
+            return memory
+        older, recent = memory[: -self.keep_entries], memory[-self.keep_entries:]
+        out: List[Entry] = []
+        if older:
+            out.append((SUMMARY_NAME, self._summary(older)))
+        out.extend(recent)
+        return self._enforce_cap(out)
+
+    def _enforce_cap(self, entries: List[Entry]) -> List[Entry]:
+        """Hard cap: clip long messages, oldest first, then drop the oldest entries (the latest is always kept)."""
+        for i in range(len(entries)):
+            total = self.tokens(entries)
+            if total <= self.max_tokens:
+                return entries
+            name, message = entries[i]
+            excess = total - self.max_tokens
+            entries[i] = (name, _clip(message, max(estimate_tokens(message) - excess, self.max_tokens // 8)))
+        while len(entries) > 1 and self.tokens(entries) > self.max_tokens:
+            entries.pop(0)
+        if self.tokens(entries) > self.max_tokens:
+            name, message = entries[0]
+            entries[0] = (name, _clip(message, self.max_tokens - estimate_tokens(name) - 2))
+        return entries
+
+    @staticmethod
+    def tokens(entries: Sequence[Entry]) -> int:
+        return sum(estimate_tokens(name) + estimate_tokens(message) + 2 for name, message in entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"summaries_cached": len(self._summaries), "summary_hits": self.hits, "summary_misses": self.misses}
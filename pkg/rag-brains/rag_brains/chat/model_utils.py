@@ -1,4 +1,7 @@
-from typing import List, Callable, Tuple, Dict, Any, Union, Optional
+from typing import List, Callable, Tuple, Dict, Any, Union, Optional, Type
+from string import Formatter
+import asyncio
+import functools
 import time
 import json
 import faiss
@@ -9,25 +12,41 @@ from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from pydantic import BaseModel, Field
 from rag_brains.retriever.connect_faiss import load_faiss_indexes
+from rag_brains.retriever.faiss_retriever import FaissRetriever
 from rag_brains.config import (
     SCOPE,
     EMBEDDING_MODEL,
     CHAT_MODEL,
 )
+from rag_brains.metrics import CONTEXT_CHUNKS, CONTEXT_COMPRESSION_CHARS, CONTEXT_TOKENS
+from cow_core.tracing import current_span
 from .apis import access_APIs
+from .context_packing import pack
+from .utils import JsonStringFieldStream
 
 TODAY = time.strftime("%Y-%m-%d")
 
 
-def _escape_format_braces(obj: Any) -> Any:
-    """Escape curly braces in string values so str.format() does not interpret JSON/code as placeholders."""
-    if isinstance(obj, str):
-        return obj.replace("{", "{{").replace("}", "}}")
-    if isinstance(obj, dict):
-        return {k: _escape_format_braces(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [_escape_format_braces(v) for v in obj]
-    return obj
+class PromptTemplate:
+    """A prompt split once at its {SLOT} placeholders ({{ and }} are literal braces); render() joins the pieces
+    with the slot values. Values are inserted as-is, so braces in JSON/code context need no escaping."""
+
+    def __init__(self, text: str):
+        self.parts: List[Tuple[str, Optional[str]]] = [
+            (literal, field) for literal, field, _, _ in Formatter().parse(text)
+        ]
+
+    def render(self, **values) -> str:
+        out = []
+        for literal, field in self.parts:
+            out.append(literal)
+            if field is not None:
+                out.append(str(values[field]))
+        return "".join(out)
+
+
+def _escape_braces(text: str) -> str:
+    return (text or "").replace("{", "{{").replace("}", "}}")
 
 
 class Prompt:
@@ -87,10 +106,11 @@ When adding keywords, adhere to these guidelines:
         )
 
     @staticmethod
-    def preprocessor(llm: ChatOpenAI | ChatAnthropic, scope: Optional[str] = None, **kwargs):
-        _scope = scope if scope is not None else SCOPE
+    @functools.lru_cache(maxsize=32)
+    def _preprocessor_prompt(scope: str) -> Tuple[Type[BaseModel], PromptTemplate]:
+        """Output schema and header template of the preprocessor, built once per scope."""
         preprocessor_header = f"""
-You are a part of a helpful chatbot assistant system that provides information about {_scope}.
+You are a part of a helpful chatbot assistant system that provides information about {_escape_braces(scope)}.
 
 The context of the conversation is as follows: 
 
@@ -108,7 +128,7 @@ The user now provided the following query:
         class Preprocessor(BaseModel):
             related_to_scope: bool = Field(
                 default=False,
-                description=f"""Return False if you are 100% sure that the user's query is not related to the scope of {_scope}. Keep in mind that, most of the time, the user will ask a question related to the scope.""",
+                description=f"""Return False if you are 100% sure that the user's query is not related to the scope of {scope}. Keep in mind that, most of the time, the user will ask a question related to the scope.""",
             )
 
             needs_info: bool = Field(
@@ -118,7 +138,7 @@ The user now provided the following query:
 
             answer: Optional[str] = Field(
                 default=None,
-                description=f"""Only if needs_info is False, that is, if you have enough information to answer the user's query, provide an answer to the user's query. Don't make up information. If related_to_scope is False, answer should be 'I'm sorry, but I can only answer questions about {_scope}. Is there anything specific about {_scope} you'd like to know?'""",
+                description=f"""Only if needs_info is False, that is, if you have enough information to answer the user's query, provide an answer to the user's query. Don't make up information. If related_to_scope is False, answer should be 'I'm sorry, but I can only answer questions about {scope}. Is there anything specific about {scope} you'd like to know?'""",
             )
 
             expansion: Prompt.NewSearch = Field(
@@ -126,16 +146,31 @@ The user now provided the following query:
                 description="""Only if needs_info is True, that is, if you don't have enough information to answer the user's query, provide a new search that encompasses the information that is missing. The system will perform a search. This is going to be used by the system to retrieve a context that can provide this information. The user won't see this.""",
             )
 
-        llm = llm.with_structured_output(Preprocessor)
-        safe_kwargs = _escape_format_braces(kwargs)
-        return llm.invoke(preprocessor_header.format(**safe_kwargs)).dict()
+        return Preprocessor, PromptTemplate(preprocessor_header)
 
     @staticmethod
-    def responder(llm: ChatOpenAI | ChatAnthropic, final: bool = False, scope: Optional[str] = None, responder_extra: str = "", **kwargs):
-        _scope = scope if scope is not None else SCOPE
-        # Escape braces in scope/responder_extra so they are not interpreted as placeholders by .format() later
-        _scope_safe = (_scope or "").replace("{", "{{").replace("}", "}}")
-        _responder_extra_safe = (responder_extra or "").replace("{", "{{").replace("}", "}}")
+    def _preprocessor_call(llm: ChatOpenAI | ChatAnthropic, scope: Optional[str], kwargs: dict):
+        """Return (structured llm, rendered prompt) for the preprocessor."""
+        schema, template = Prompt._preprocessor_prompt(scope if scope is not None else SCOPE)
+        return llm.with_structured_output(schema), template.render(**kwargs)
+
+    @staticmethod
+    def preprocessor(llm: ChatOpenAI | ChatAnthropic, scope: Optional[str] = None, **kwargs):
+        llm, prompt = Prompt._preprocessor_call(llm, scope, kwargs)
+        return llm.invoke(prompt).dict()
+
+    @staticmethod
+    async def apreprocessor(llm: ChatOpenAI | ChatAnthropic, scope: Optional[str] = None, **kwargs):
+        llm, prompt = Prompt._preprocessor_call(llm, scope, kwargs)
+        return (await llm.ainvoke(prompt)).dict()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _responder_prompt(final: bool, scope: str, responder_extra: str) -> Tuple[Type[BaseModel], PromptTemplate]:
+        """Output schema and header template of the responder, built once per (final, scope, responder_extra)."""
+        # Escape braces in scope/responder_extra so they are not taken as slots of the template
+        _scope_safe = _escape_braces(scope)
+        _responder_extra_safe = _escape_braces(responder_extra)
         responder_header = f"""
 You are a helpful assistant that provides information about {_scope_safe}. Your goal is to give polite, informative, assertive, objective, and brief answers. Avoid jargon and explain any technical terms, as the user may not be a specialist.{_responder_extra_safe}
 
@@ -182,19 +217,28 @@ Today's date is {TODAY}. Be aware of information that might be outdated.
                     description="""If you didn't write an answer, provide a new search that encompasses the information that is missing. The system will perform a search. This is going to be used by the system to retrieve a context that can provide this information. The user won't see this.""",
                 )
 
-        llm = llm.with_structured_output(Responder)
-        safe_kwargs = _escape_format_braces(kwargs)
-        try:
-            out = llm.invoke(responder_header.format(**safe_kwargs))
-        except Exception as e:
-            import logging
-            import traceback
-            log = logging.getLogger(__name__)
-            log.warning(
-                "Responder LLM invoke failed: %s: %s\nTraceback: %s",
-                type(e).__name__, e, traceback.format_exc(),
-            )
-            return None
+        return Responder, PromptTemplate(responder_header)
+
+    @staticmethod
+    def _responder_call(llm: ChatOpenAI | ChatAnthropic, final: bool, scope: Optional[str], responder_extra: str, kwargs: dict):
+        """Return (structured llm, rendered prompt) for the responder."""
+        schema, template = Prompt._responder_prompt(
+            bool(final), scope if scope is not None else SCOPE, responder_extra or ""
+        )
+        return llm.with_structured_output(schema), template.render(**kwargs)
+
+    @staticmethod
+    def _log_responder_failure(e: Exception):
+        import logging
+        import traceback
+        log = logging.getLogger(__name__)
+        log.warning(
+            "Responder LLM invoke failed: %s: %s\nTraceback: %s",
+            type(e).__name__, e, traceback.format_exc(),
+        )
+
+    @staticmethod
+    def _responder_output(out) -> Optional[dict]:
         try:
             if hasattr(out, "model_dump"):
                 return out.model_dump()
@@ -207,6 +251,48 @@ Today's date is {TODAY}. Be aware of information that might be outdated.
             )
             return None
 
+    @staticmethod
+    def responder(llm: ChatOpenAI | ChatAnthropic, final: bool = False, scope: Optional[str] = None, responder_extra: str = "", **kwargs):
+        llm, prompt = Prompt._responder_call(llm, final, scope, responder_extra, kwargs)
+        try:
+            out = llm.invoke(prompt)
+        except Exception as e:
+            Prompt._log_responder_failure(e)
+            return None
+        return Prompt._responder_output(out)
+
+    @staticmethod
+    async def _astream_structured(llm, prompt: str, on_token: Callable[[str], None]):
+        """Stream a structured LLM that exposes astream()/parse_text(), forwarding answer text as it arrives."""
+        answer_stream = JsonStringFieldStream()
+        chunks = []
+        async for chunk in llm.astream(prompt):
+            chunks.append(chunk)
+            delta = answer_stream.feed(chunk)
+            if delta:
+                on_token(delta)
+        return llm.parse_text("".join(chunks))
+
+    @staticmethod
+    async def aresponder(
+        llm: ChatOpenAI | ChatAnthropic,
+        final: bool = False,
+        scope: Optional[str] = None,
+        responder_extra: str = "",
+        on_token: Optional[Callable[[str], None]] = None,
+        **kwargs,
+    ):
+        llm, prompt = Prompt._responder_call(llm, final, scope, responder_extra, kwargs)
+        try:
+            if on_token is not None and hasattr(llm, "parse_text"):
+                out = await Prompt._astream_structured(llm, prompt, on_token)
+            else:
+                out = await llm.ainvoke(prompt)
+        except Exception as e:
+            Prompt._log_responder_failure(e)
+            return None
+        return Prompt._responder_output(out)
+
 
 class ContextHandling:
     summary_template = """
@@ -235,7 +321,13 @@ class ContextHandling:
         query: str | None = None,
         type_search: str = "factual",
         k: int = 10,
+        token_budget: Optional[int] = None,
+        max_chunk_tokens: Optional[int] = None,
+        compressor: Optional[Callable[[Any, List[str]], str]] = None,
     ) -> Tuple[str, list]:
+        """Interleave the contexts of each question by rank and format them. A compressor (e.g.
+        compression.ExtractiveCompressor) maps (doc, [query, *questions]) to the text sent for that doc; with
+        token_budget, the ranked contexts are then packed into that many (estimated) tokens (context_packing.pack)."""
         contexts_to_be_explored = {}
         for question, contexts in question_context.items():
             new_contexts = contexts
@@ -281,15 +373,58 @@ class ContextHandling:
                 if c.metadata.get("url")
             }
 
-        return ContextHandling.format(contexts_to_be_explored, question_context)
+        contents = None
+        if compressor is not None and contexts_to_be_explored:
+            queries = [q for q in [query, *question_context.keys()] if q]
+            contents = {key: compressor(c, queries) for key, c in contexts_to_be_explored.items()}
+            before = sum(len(c.page_content or "") for c in contexts_to_be_explored.values())
+            after = sum(len(text) for text in contents.values())
+            CONTEXT_COMPRESSION_CHARS.inc(before, stage="input")
+            CONTEXT_COMPRESSION_CHARS.inc(after, stage="output")
+            current_span().set(compression_chars_in=before, compression_chars_out=after)
+
+        return ContextHandling.format(
+            contexts_to_be_explored,
+            question_context,
+            token_budget=token_budget,
+            max_chunk_tokens=max_chunk_tokens,
+            contents=contents,
+        )
+
+    @staticmethod
+    def _pack(
+        context: dict, token_budget: Optional[int], max_chunk_tokens: Optional[int], contents: Optional[dict] = None
+    ) -> Dict[Any, str]:
+        """Contents to send per context key (contents overrides page_content), in rank order, fitted into the budget."""
+        contents = contents or {}
+        packed = pack(
+            ((key, contents.get(key, c.page_content)) for key, c in context.items()), token_budget, max_chunk_tokens
+        )
+        CONTEXT_TOKENS.observe(packed.tokens)
+        CONTEXT_CHUNKS.inc(len(packed.items) - packed.truncated, outcome="kept")
+        CONTEXT_CHUNKS.inc(packed.truncated, outcome="truncated")
+        CONTEXT_CHUNKS.inc(packed.dropped, outcome="dropped")
+        current_span().set(
+            context_tokens=packed.tokens, chunks_truncated=packed.truncated, chunks_dropped=packed.dropped
+        )
+        return dict(packed.items)
 
     @staticmethod
-    def format(context: dict, context_dict: dict) -> Tuple[str, list]:
+    def format(
+        context: dict,
+        context_dict: dict,
+        token_budget: Optional[int] = None,
+        max_chunk_tokens: Optional[int] = None,
+        contents: Optional[dict] = None,
+    ) -> Tuple[str, list]:
+        contents = ContextHandling._pack(context, token_budget, max_chunk_tokens, contents)
+        context = {key: c for key, c in context.items() if key in contents}
         # Build ordered list of unique URLs (1-based index = reference number [1], [2], ...)
         url_list = list(dict.fromkeys(c.metadata.get("url") for c in context.values() if c.metadata.get("url")))
         url_to_num = {u: i for i, u in enumerate(url_list, start=1)}
         out = []
-        for c in context.values():
+        for key, c in context.items():
+            content = contents[key]
             type_db = c.metadata.get("type_db_info", "")
             url = c.metadata.get("url") or ""
             n = url_to_num.get(url, 0)
@@ -302,7 +437,7 @@ class ContextHandling:
                             CREATED_AT=c.metadata["created_at"],
                             LAST_POST_AT=c.metadata["last_posted_at"],
                             URL=c.metadata["url"],
-                            CONTENT=c.page_content,
+                            CONTENT=content,
                         )
                     )
                 case "docs_fragment" | "api-endpoint" | "api-schema":
@@ -310,16 +445,16 @@ class ContextHandling:
                         ContextHandling.doc_fragment_template.format(
                             N=n,
                             URL=c.metadata.get("url", ""),
-                            CONTENT=c.page_content,
+                            CONTENT=content,
                         )
                     )
                 case _:
-                    if url and c.page_content:
+                    if url and content:
                         out.append(
                             ContextHandling.doc_fragment_template.format(
                                 N=n,
                                 URL=url,
-                                CONTENT=c.page_content,
+                                CONTENT=content,
                             )
                         )
         return "".join(out), url_list
@@ -346,9 +481,7 @@ class RetrieverBuilder:
         if faiss_path is None or embedding_model is None:
             raise ValueError("faiss_path and embedding_model are required")
         db = await load_faiss_indexes(faiss_path=faiss_path, embedding_model=embedding_model)
-        async def _retriever(query, contexts_df=None, **kwargs):
-            return db.similarity_search(query, **retriever_pars)
-        return _retriever
+        return FaissRetriever(db, index_path=faiss_path, **retriever_pars)
 
     @staticmethod
     def build_index(index, index_embed, k_max, treshold):
@@ -368,7 +501,7 @@ class RetrieverBuilder:
         ):
             if treshold < 1:
                 if treshold > 0:
-                    query_embed = np.array(embeddings.embed_documents([query]))
+                    query_embed = np.array(await asyncio.to_thread(embeddings.embed_documents, [query]))
                     distances, indices = index_faiss.search(query_embed, k_max)
 
                     similar = [index_keys[i] for i in indices[0]]
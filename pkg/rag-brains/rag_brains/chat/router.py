@@ -0,0 +1,152 @@
+"""
+Local query router: decides from the query embedding and a few rules whether the preprocessor LLM call
+can be skipped.
+
+Two centroids are compared by cosine similarity:
+- in scope: mean of the index vectors, blended with the mean of embedded example in-scope queries
+  (documents and queries do not sit in the same region of the embedding space);
+- off topic: mean of embedded generic off-topic queries.
+They are computed once per index version (build_faiss, or lazily at startup) and stored next to the index.
+Anything ambiguous returns None and goes through the LLM preprocessor as before.
+"""
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+import hashlib
+import io
+import os
+import re
+
+import numpy as np
+
+# Stored next to index.faiss / index.pkl
+ROUTER_FILE = "query_router.npz"
+
+DEFAULT_OFF_TOPIC_SEEDS: Tuple[str, ...] = (
+    "What's the weather like today?",
+    "Write me a poem about the sea",
+    "Tell me a joke",
+    "Who won the football match yesterday?",
+    "Give me a recipe for chocolate cake",
+    "What is the capital of France?",
+    "Recommend a good movie to watch tonight",
+    "How do I lose weight fast?",
+    "Translate this sentence to Spanish",
+    "What is the meaning of life?",
+    "Help me write a cover letter for a job",
+    "Who is the president of the United States?",
+)
+
+_CHITCHAT_RE = re.compile(
+    r"^\s*(hi|hello|hey|yo|thanks|thank you|thx|ok|okay|cool|great|bye|good (morning|afternoon|evening|night))\b",
+    re.IGNORECASE,
+)
+
+
+def _unit(v: np.ndarray) -> np.ndarray:
+    v = np.asarray(v, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm > 0 else v
+
+
+def _mean_direction(rows: np.ndarray) -> np.ndarray:
+    rows = np.asarray(rows, dtype=np.float32)
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return _unit((rows / norms).mean(axis=0))
+
+
+def seeds_hash(*seed_lists: Sequence[str]) -> str:
+    return hashlib.sha256("\x00".join(s for seeds in seed_lists for s in seeds).encode()).hexdigest()[:8]
+
+
+class QueryRouter:
+    """Route first-turn queries without an LLM call.
+
+    route(query, vector, memory) returns:
+    - (False, off_topic_answer) when the query is clearly closer to the off-topic centroid;
+    - (True, ("", [], "factual")) when it is a plain question clearly closer to the in-scope centroid
+      (the reasoning loop then searches the query itself);
+    - None otherwise (follow-ups, chit-chat, very short/long queries, close calls).
+    The tuples have the shape of RAGSystem._parse_preprocessor_output.
+    """
+
+    def __init__(
+        self,
+        in_scope: np.ndarray,
+        off_topic: np.ndarray,
+        version: str = "",
+        off_topic_answer: str = "",
+        off_topic_margin: float = 0.08,
+        in_scope_margin: float = 0.02,
+        min_words: int = 3,
+        max_words: int = 60,
+    ):
+        self.in_scope = _unit(in_scope)
+        self.off_topic = _unit(off_topic)
+        self.version = version
+        self.off_topic_answer = off_topic_answer
+        self.off_topic_margin = off_topic_margin
+        self.in_scope_margin = in_scope_margin
+        self.min_words = min_words
+        self.max_words = max_words
+
+    @classmethod
+    def build(
+        cls,
+        db,
+        embed_queries: Callable[[List[str]], np.ndarray],
+        in_scope_seeds: Sequence[str] = (),
+        off_topic_seeds: Sequence[str] = DEFAULT_OFF_TOPIC_SEEDS,
+        version: str = "",
+        **kwargs,
+    ) -> "QueryRouter":
+        """Compute the centroids from a LangChain FAISS store (blocking: one embedding call for the seeds)."""
+        doc_centroid = _mean_direction(db.index.reconstruct_n(0, db.index.ntotal))
+        seeds = list(in_scope_seeds) + list(off_topic_seeds)
+        vectors = np.asarray(embed_queries(seeds), dtype=np.float32)
+        n_in = len(in_scope_seeds)
+        in_scope = doc_centroid
+        if n_in:
+            in_scope = _unit(doc_centroid + _mean_direction(vectors[:n_in]))
+        return cls(in_scope, _mean_direction(vectors[n_in:]), version=version, **kwargs)
+
+    def save(self, directory: str):
+        buf = io.BytesIO()
+        np.savez(buf, in_scope=self.in_scope, off_topic=self.off_topic, version=np.array(self.version))
+        tmp = os.path.join(directory, ROUTER_FILE + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(buf.getvalue())
+        os.replace(tmp, os.path.join(directory, ROUTER_FILE))
+
+    @classmethod
+    def load(cls, directory: str, version: str, **kwargs) -> Optional["QueryRouter"]:
+        """Stored router for this version, or None if missing or stale."""
+        path = os.path.join(directory, ROUTER_FILE)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if str(data["version"]) != version:
+                    return None
+                return cls(data["in_scope"], data["off_topic"], version=version, **kwargs)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def scores(self, vector) -> Tuple[float, float]:
+        v = _unit(vector)
+        if v.shape != self.in_scope.shape:
+            return 0.0, 0.0
+        return float(v @ self.in_scope), float(v @ self.off_topic)
+
+    def route(self, query: str, vector, memory: list | None = None) -> Optional[Tuple[bool, Any]]:
+        if memory:
+            # Follow-ups may be answerable from the history or need rewriting: leave them to the LLM
+            return None
+        n_words = len((query or "").split())
+        if n_words < self.min_words or n_words > self.max_words or _CHITCHAT_RE.match(query or ""):
+            return None
+        s_in, s_off = self.scores(vector)
+        if s_off - s_in >= self.off_topic_margin and self.off_topic_answer:
+            return False, self.off_topic_answer
+        if s_in - s_off >= self.in_scope_margin:
+            return True, ("", [], "factual")
+        return None
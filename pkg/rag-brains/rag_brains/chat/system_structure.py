@@ -1,7 +1,12 @@
 from typing import Tuple, Any, Callable, List
 from rag_brains.chat.apis import access_APIs
+from rag_brains.metrics import PREPROCESSOR_PATH, REASONING_LEVELS, STAGE_SECONDS
+from cow_core import deadline
+from cow_core.tracing import current_span, span
 import pandas as pd
 
+import asyncio
+import inspect
 import re
 
 # Match reference citations like [1], [2], "reference [1]", "ref [2]". Used to return only cited URLs.
@@ -54,37 +59,61 @@ class RAGSystem:
     REASONING_LIMIT: int
     models_to_use: list
     retriever: Callable
+    batch_retriever: Callable | None
+    query_router: Callable | None
     context_filter: Callable
     system_prompt_preprocessor: Callable
     system_prompt_responder: Callable
 
-    llm: list = []
+    llm: list
     number_of_models: int = 2
 
     def __init__(self, **kwargs):
         self.REASONING_LIMIT = kwargs.get("REASONING_LIMIT") or kwargs.get("reasoning_limit", 3)
         self.models_to_use = kwargs.get("models_to_use")
         self.retriever = kwargs.get("retriever")
+        # Optional: async (queries, reasoning_level) -> one context list per query, all searched in one batch
+        self.batch_retriever = kwargs.get("batch_retriever")
+        # Optional: async (query, memory) -> None, or (needs_info, preprocess_reasoning) to skip the preprocessor LLM
+        self.query_router = kwargs.get("query_router")
         self.context_filter = kwargs.get("context_filter")
         self.system_prompt_preprocessor = kwargs.get("system_prompt_preprocessor")
         self.system_prompt_responder = kwargs.get("system_prompt_responder")
 
         assert len(self.models_to_use) == self.number_of_models
 
-        for m in self.models_to_use:
-            m, pars = m
-            self.llm += [access_APIs.get_llm(m, **pars)]
-
-    def query_preprocessing_LLM(
-        self, query: str, memory: list, LLM: Any = None
-    ) -> Tuple[bool, str | Tuple[str, list]]:
-        if LLM is None:
-            LLM = self.llm[0]
+        # Per-instance list: a class-level list would keep growing with every RAGSystem built
+        self.llm = [access_APIs.get_llm(m, **pars) for m, pars in self.models_to_use]
+
+    @staticmethod
+    async def _call_prompt(prompt_fn: Callable, *args, **kwargs):
+        """Await async prompt functions; run sync ones in a worker thread so the event loop is never blocked."""
+        if inspect.iscoroutinefunction(prompt_fn):
+            return await prompt_fn(*args, **kwargs)
+        return await asyncio.to_thread(prompt_fn, *args, **kwargs)
+
+    async def _retrieve_level(self, questions: List[dict], reasoning_level: int) -> list:
+        """Contexts for each question (same order): one batch if batch_retriever is set, else concurrent calls."""
+        if not questions:
+            return []
+        with span("retrieve", level=reasoning_level, queries=[list(q.values())[0] for q in questions]) as s:
+            if self.batch_retriever is not None:
+                retrieved = await self.batch_retriever(questions, reasoning_level=reasoning_level)
+            else:
+                retrieved = await asyncio.gather(
+                    *[self.retriever(q, reasoning_level=reasoning_level) for q in questions]
+                )
+            s.set(urls=[[(getattr(d, "metadata", None) or {}).get("url") for d in docs] for docs in retrieved])
+        return retrieved
 
-        output_LLM = self.system_prompt_preprocessor(
-            LLM, QUERY=query, CONVERSATION_HISTORY=memory
-        )
+    @staticmethod
+    def _discard(task: asyncio.Task):
+        """Cancel a speculative task without leaving an unretrieved exception behind."""
+        task.cancel()
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
 
+    @staticmethod
+    def _parse_preprocessor_output(output_LLM: dict) -> Tuple[bool, str | Tuple[str, list]]:
         print(output_LLM)
 
         if not output_LLM["needs_info"]:
@@ -101,27 +130,33 @@ class RAGSystem:
 
             return True, (user_knowledge, keywords + questions, type_search)
 
-    def responder_LLM(
-        self,
-        query: str,
-        context: str,
-        user_knowledge: str,
-        summary_of_explored_contexts: str,
-        final: bool = False,
-        LLM: Any = None,
-    ):  # -> Tuple[str|list, bool]:
+    def query_preprocessing_LLM(
+        self, query: str, memory: list, LLM: Any = None
+    ) -> Tuple[bool, str | Tuple[str, list]]:
         if LLM is None:
-            LLM = self.llm[1]
+            LLM = self.llm[0]
 
-        output_LLM = self.system_prompt_responder(
-            LLM,
-            final=final,
-            QUERY=query,
-            CONTEXT=context,
-            USER_KNOWLEDGE=user_knowledge,
-            SUMMARY_OF_EXPLORED_CONTEXTS=summary_of_explored_contexts,
-        )
+        with STAGE_SECONDS.time(stage="preprocessor_llm"):
+            output_LLM = self.system_prompt_preprocessor(
+                LLM, QUERY=query, CONVERSATION_HISTORY=memory
+            )
+        return self._parse_preprocessor_output(output_LLM)
 
+    async def aquery_preprocessing_LLM(
+        self, query: str, memory: list, LLM: Any = None
+    ) -> Tuple[bool, str | Tuple[str, list]]:
+        if LLM is None:
+            LLM = self.llm[0]
+
+        with STAGE_SECONDS.time(stage="preprocessor_llm"), span("preprocessor") as s:
+            output_LLM = await self._call_prompt(
+                self.system_prompt_preprocessor, LLM, QUERY=query, CONVERSATION_HISTORY=memory
+            )
+            s.set(needs_info=bool(output_LLM and output_LLM.get("needs_info")))
+        return self._parse_preprocessor_output(output_LLM)
+
+    @staticmethod
+    def _parse_responder_output(output_LLM: dict | None):  # -> Tuple[str|list, bool]:
         if output_LLM is None:
             return ("", [], ""), False
 
@@ -140,6 +175,103 @@ class RAGSystem:
             type_search = output_LLM["search"]["type_search"]
             return [knowledge_summary, new_questions, type_search], False
 
+    def responder_LLM(
+        self,
+        query: str,
+        context: str,
+        user_knowledge: str,
+        summary_of_explored_contexts: str,
+        final: bool = False,
+        LLM: Any = None,
+    ):  # -> Tuple[str|list, bool]:
+        if LLM is None:
+            LLM = self.llm[1]
+
+        with STAGE_SECONDS.time(stage="responder_llm"):
+            output_LLM = self.system_prompt_responder(
+                LLM,
+                final=final,
+                QUERY=query,
+                CONTEXT=context,
+                USER_KNOWLEDGE=user_knowledge,
+                SUMMARY_OF_EXPLORED_CONTEXTS=summary_of_explored_contexts,
+            )
+        return self._parse_responder_output(output_LLM)
+
+    async def aresponder_LLM(
+        self,
+        query: str,
+        context: str,
+        user_knowledge: str,
+        summary_of_explored_contexts: str,
+        final: bool = False,
+        LLM: Any = None,
+        on_token: Callable[[str], None] | None = None,
+    ):  # -> Tuple[str|list, bool]:
+        if LLM is None:
+            LLM = self.llm[1]
+
+        # Only streaming-aware responders receive on_token
+        stream_kwargs = {"on_token": on_token} if on_token is not None else {}
+        with STAGE_SECONDS.time(stage="responder_llm"), span("responder", final=final):
+            output_LLM = await self._call_prompt(
+                self.system_prompt_responder,
+                LLM,
+                final=final,
+                **stream_kwargs,
+                QUERY=query,
+                CONTEXT=context,
+                USER_KNOWLEDGE=user_knowledge,
+                SUMMARY_OF_EXPLORED_CONTEXTS=summary_of_explored_contexts,
+            )
+        return self._parse_responder_output(output_LLM)
+
+    @staticmethod
+    def _apply_cited_references(result: dict, context_urls: list) -> dict:
+        """Keep only the references actually cited in the answer: map [1], [2] to context_urls by index (1-based).
+        Renumber citations so they are sequential [1], [2], ... matching url_supporting (deduped URLs)."""
+        answer_text = result.get("answer") or ""
+        cited = _cited_reference_numbers(answer_text)
+        if cited:
+            # Build deduped ordered_urls and map each cited index to its 1-based rank in that list.
+            ordered_urls = []
+            seen = set()
+            for i in cited:
+                if 1 <= i <= len(context_urls):
+                    u = context_urls[i - 1]
+                    if u and u not in seen:
+                        seen.add(u)
+                        ordered_urls.append(u)
+            result["url_supporting"] = ordered_urls
+            url_to_rank = {u: r for r, u in enumerate(ordered_urls, start=1)}
+            old_to_new = {}
+            for i in cited:
+                if 1 <= i <= len(context_urls):
+                    u = context_urls[i - 1]
+                    if u:
+                        old_to_new[i] = url_to_rank[u]
+            answer_text = _renumber_citations_with_mapping(answer_text, old_to_new)
+            n_refs = len(ordered_urls)
+            # Remove orphan citation markers (e.g. [11] when we only have 3 URLs)
+            for orphan in range(n_refs + 1, 20):
+                answer_text = re.sub(r"\[" + str(orphan) + r"\]", "", answer_text)
+            # Normalize "References: ..." line to exactly [1] [2] ... so it matches url_supporting
+            refs_line = " ".join(f"[{r}]" for r in range(1, n_refs + 1))
+            if re.search(r"\breferences?\s*:", answer_text, re.IGNORECASE):
+                answer_text = re.sub(
+                    r"\breferences?\s*:\s*(?:\[\d+\]\s*)*",
+                    f"References: {refs_line}",
+                    answer_text,
+                    flags=re.IGNORECASE,
+                    count=1,
+                )
+            elif n_refs > 0:
+                answer_text = answer_text.rstrip() + f"\n\nReferences: {refs_line}"
+            result["answer"] = answer_text
+        else:
+            result["url_supporting"] = list(result.get("url_supporting") or [])[:6]
+        return result
+
     async def predict(
         self,
         query: str,
@@ -147,18 +279,106 @@ class RAGSystem:
         memory: list = [],
         verbose: bool = False,
     ) -> str:
-        needs_info, preprocess_reasoning = self.query_preprocessing_LLM(
-            query, memory=memory
-        )
+        """Kept for existing callers; same as apredict (LLM calls never block the event loop)."""
+        return await self.apredict(query, contexts_df, memory=memory, verbose=verbose)
+
+    async def apredict(
+        self,
+        query: str,
+        contexts_df: pd.DataFrame,
+        memory: list = [],
+        verbose: bool = False,
+        emit: Callable[[str, dict], None] | None = None,
+    ) -> str:
+        """Run the reasoning loop. If emit is given, it is called with stage events as they happen:
+        ("retrieval", ...), ("references", ...) and ("token", {"text": ...}) for streamed answer text.
+
+        Under a request deadline (cow_core.deadline), remaining work is cancelled when it expires and the best
+        partial result is returned: the references found so far, flagged as a fallback."""
+        progress = {"history": None, "context_urls": []}
+        left = deadline.remaining()
+        if left is None:
+            return await self._apredict(query, contexts_df, memory, verbose, emit, progress)
+        try:
+            async with asyncio.timeout(max(left, 0)):
+                return await self._apredict(query, contexts_df, memory, verbose, emit, progress)
+        except TimeoutError:
+            if not deadline.expired():
+                # A call's own timeout, not the request deadline
+                raise
+        return self._deadline_result(query, progress, verbose)
+
+    @staticmethod
+    def _deadline_result(query: str, progress: dict, verbose: bool = False) -> dict:
+        urls = list(dict.fromkeys(u for u in progress["context_urls"] if u))[:6]
+        if urls:
+            text = "I couldn't finish a full answer in time. These references look the most relevant to your question."
+        else:
+            text = "I couldn't answer in time. Please try again or ask a more specific question."
+        history_reasoning = progress["history"] or {
+            "query": query,
+            "needs_info": True,
+            "preprocess_reasoning": None,
+            "routed": False,
+            "reasoning": {},
+        }
+        history_reasoning["answer"] = {"answer": text, "url_supporting": urls}
+        history_reasoning["fallback"] = True
+        history_reasoning["deadline_exceeded"] = True
+        current_span().set(deadline_exceeded=True)
+        if verbose:
+            print(f"-------Deadline exceeded; returning {len(urls)} references.\n")
+        return history_reasoning
+
+    async def _apredict(
+        self,
+        query: str,
+        contexts_df: pd.DataFrame,
+        memory: list,
+        verbose: bool,
+        emit: Callable[[str, dict], None] | None,
+        progress: dict,
+    ) -> dict:
+        routed = None
+        if self.query_router is not None:
+            try:
+                with span("query_router") as router_span:
+                    routed = await self.query_router(query, memory)
+                    router_span.set(routed=routed is not None)
+            except Exception as e:
+                # The router is an optimization; fall back to the preprocessor LLM
+                print(f"[query_router] failed: {e}", flush=True)
+        # Level 0 always searches the raw query, so start that retrieval while the preprocessor LLM runs
+        speculative = None
+        PREPROCESSOR_PATH.inc(path="router" if routed is not None else "llm")
+        if routed is not None:
+            needs_info, preprocess_reasoning = routed
+        else:
+            speculative = asyncio.create_task(self._retrieve_level([{"query": query}], 0))
+            try:
+                needs_info, preprocess_reasoning = await self.aquery_preprocessing_LLM(
+                    query, memory=memory
+                )
+            except BaseException:
+                self._discard(speculative)
+                raise
+            if not needs_info:
+                self._discard(speculative)
+                speculative = None
         history_reasoning = {
             "query": query,
             "needs_info": needs_info,
             "preprocess_reasoning": preprocess_reasoning,
+            # True when the local router decided instead of the preprocessor LLM
+            "routed": routed is not None,
             "reasoning": {},
+            # True when the answer is a canned fallback (e.g. responder failure) rather than a generated one
+            "fallback": False,
         }
+        progress["history"] = history_reasoning
         if verbose:
             print(
-                f"-------------------\nQuery: {query}\nNeeds info: {needs_info}\nPreprocess reasoning: {preprocess_reasoning}\n"
+                f"-------------------\nQuery: {query}\nRouted: {routed is not None}\nNeeds info: {needs_info}\nPreprocess reasoning: {preprocess_reasoning}\n"
             )
         if needs_info:
             is_enough = False
@@ -173,101 +393,85 @@ class RAGSystem:
                 if reasoning_level >= max_level:
                     result = {"answer": "I couldn't find enough information to answer. Please try rephrasing or ask something more specific.", "url_supporting": []}
                     is_enough = True
+                    history_reasoning["fallback"] = True
                     if verbose:
                         print(f"-------Hit max reasoning level {max_level}, returning fallback.\n")
                     break
 
-                summary_of_explored_contexts, questions, type_search = result
-                try:
-                    questions = [{"query": query}] + questions
-                except Exception:
-                    pass
+                with span("reasoning_level", level=reasoning_level) as level_span:
+                    summary_of_explored_contexts, questions, type_search = result
+                    try:
+                        questions = [{"query": query}] + questions
+                    except Exception:
+                        pass
+
+                    # Dispatch all retrievals of this level at once; zip keeps the original question order
+                    try:
+                        if speculative is not None and questions[:1] == [{"query": query}]:
+                            # Raw query already in flight: only the expansion questions are searched now
+                            first, rest = await asyncio.gather(
+                                speculative, self._retrieve_level(questions[1:], reasoning_level)
+                            )
+                            retrieved = list(first) + list(rest)
+                        else:
+                            retrieved = await self._retrieve_level(questions, reasoning_level)
+                    finally:
+                        if speculative is not None:
+                            self._discard(speculative)
+                            speculative = None
+                    context_dict = {
+                        list(q.values())[0]: contexts
+                        for q, contexts in zip(questions, retrieved)
+                    }
+                    # context_dict = {c.metadata['url']:c for cc in context_list for c in cc}
+                    if emit is not None:
+                        emit("retrieval", {"reasoning_level": reasoning_level, "queries": list(context_dict.keys())})
+
+                    with STAGE_SECONDS.time(stage="context_filter"), span("context_filter", type_search=type_search) as filter_span:
+                        context, context_urls = await self.context_filter(
+                            context_dict,
+                            explored_contexts_urls,
+                            contexts_df,
+                            query,
+                            type_search,
+                        )
+                        filter_span.set(urls=list(context_urls), context_chars=len(context or ""))
+                    explored_contexts_urls.extend(context_urls)
+                    progress["context_urls"].extend(context_urls)
+                    if emit is not None:
+                        emit("references", {"reasoning_level": reasoning_level, "urls": list(context_urls)})
 
-                context_dict = {
-                    list(q.values())[0]: await self.retriever(
-                        q, reasoning_level=reasoning_level
+                    if verbose:
+                        print(
+                            f"-------Reasoning level {reasoning_level}\nExploring Context URLS: {context_urls}"
+                        )
+
+                    result, is_enough = await self.aresponder_LLM(
+                        query,
+                        context,
+                        user_knowledge,
+                        summary_of_explored_contexts,
+                        final=reasoning_level > self.REASONING_LIMIT,
+                        on_token=(lambda text: emit("token", {"text": text})) if emit is not None else None,
                     )
-                    for q in questions
-                }
-                # context_dict = {c.metadata['url']:c for cc in context_list for c in cc}
-
-                context, context_urls = await self.context_filter(
-                    context_dict,
-                    explored_contexts_urls,
-                    contexts_df,
-                    query,
-                    type_search,
-                )
-                explored_contexts_urls.extend(context_urls)
 
-                if verbose:
-                    print(
-                        f"-------Reasoning level {reasoning_level}\nExploring Context URLS: {context_urls}"
-                    )
+                    if is_enough and isinstance(result, dict) and result.get("url_supporting") is not None and context_urls:
+                        with STAGE_SECONDS.time(stage="citations"), span("citations"):
+                            result = self._apply_cited_references(result, context_urls)
 
-                result, is_enough = self.responder_LLM(
-                    query,
-                    context,
-                    user_knowledge,
-                    summary_of_explored_contexts,
-                    final=reasoning_level > self.REASONING_LIMIT,
-                )
+                    # If responder failed (e.g. LLM error) but we have context, return a fallback so we don't loop
+                    if not is_enough and context and isinstance(result, (list, tuple)) and len(result) == 3 and result[0] == "" and result[1] == []:
+                        result = {"answer": "I found relevant documentation but couldn't generate a full answer. Please try rephrasing or ask a more specific question.", "url_supporting": list(context_urls)}
+                        is_enough = True
+                        history_reasoning["fallback"] = True
+                        if verbose:
+                            print("-------Responder returned empty with context; using fallback.\n")
 
-                # Use only the references actually cited in the answer: map [1], [2] to context_urls by index (1-based).
-                # Renumber citations so they are sequential [1], [2], ... matching url_supporting (deduped URLs).
-                if is_enough and isinstance(result, dict) and result.get("url_supporting") is not None and context_urls:
-                    answer_text = result.get("answer") or ""
-                    cited = _cited_reference_numbers(answer_text)
-                    if cited:
-                        # Build deduped ordered_urls and map each cited index to its 1-based rank in that list.
-                        ordered_urls = []
-                        seen = set()
-                        for i in cited:
-                            if 1 <= i <= len(context_urls):
-                                u = context_urls[i - 1]
-                                if u and u not in seen:
-                                    seen.add(u)
-                                    ordered_urls.append(u)
-                        result["url_supporting"] = ordered_urls
-                        url_to_rank = {u: r for r, u in enumerate(ordered_urls, start=1)}
-                        old_to_new = {}
-                        for i in cited:
-                            if 1 <= i <= len(context_urls):
-                                u = context_urls[i - 1]
-                                if u:
-                                    old_to_new[i] = url_to_rank[u]
-                        answer_text = _renumber_citations_with_mapping(answer_text, old_to_new)
-                        n_refs = len(ordered_urls)
-                        # Remove orphan citation markers (e.g. [11] when we only have 3 URLs)
-                        for orphan in range(n_refs + 1, 20):
-                            answer_text = re.sub(r"\[" + str(orphan) + r"\]", "", answer_text)
-                        # Normalize "References: ..." line to exactly [1] [2] ... so it matches url_supporting
-                        refs_line = " ".join(f"[{r}]" for r in range(1, n_refs + 1))
-                        if re.search(r"\breferences?\s*:", answer_text, re.IGNORECASE):
-                            answer_text = re.sub(
-                                r"\breferences?\s*:\s*(?:\[\d+\]\s*)*",
-                                f"References: {refs_line}",
-                                answer_text,
-                                flags=re.IGNORECASE,
-                                count=1,
-                            )
-                        elif n_refs > 0:
-                            answer_text = answer_text.rstrip() + f"\n\nReferences: {refs_line}"
-                        result["answer"] = answer_text
-                    else:
-                        result["url_supporting"] = list(result.get("url_supporting") or [])[:6]
-
-                # If responder failed (e.g. LLM error) but we have context, return a fallback so we don't loop
-                if not is_enough and context and isinstance(result, (list, tuple)) and len(result) == 3 and result[0] == "" and result[1] == []:
-                    result = {"answer": "I found relevant documentation but couldn't generate a full answer. Please try rephrasing or ask a more specific question.", "url_supporting": list(context_urls)}
-                    is_enough = True
                     if verbose:
-                        print("-------Responder returned empty with context; using fallback.\n")
-
-                if verbose:
-                    print(f"-------Result: {result}\n")
-                    if is_enough:
-                        print("END!!!\n")
+                        print(f"-------Result: {result}\n")
+                        if is_enough:
+                            print("END!!!\n")
+                    level_span.set(is_enough=is_enough, n_context_urls=len(context_urls))
 
                 reasoning_level += 1
                 history_reasoning["reasoning"][reasoning_level] = {
@@ -275,7 +479,9 @@ class RAGSystem:
                     "result": result,
                 }
             answer = result
+            REASONING_LEVELS.observe(reasoning_level)
         else:
             answer = {"answer": preprocess_reasoning, "url_supporting": []}
+            REASONING_LEVELS.observe(0)
         history_reasoning["answer"] = answer
         return history_reasoning
@@ -23,3 +23,85 @@ def normalize_answer_text(text: str) -> str:
         last = m.end()
     parts.append(process_part(text[last:]))
     return "".join(parts)
+
+
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class JsonStringFieldStream:
+    """Incrementally extract string values at given key paths from JSON text that arrives in chunks.
+
+    feed(chunk) returns the newly decoded characters of the target string(s), so an answer field can be
+    shown while the rest of the JSON object is still being generated. Paths are tuples of object keys,
+    e.g. ("answer", "answer") for {"answer": {"answer": "..."}}; "[]" stands for any array element.
+    """
+
+    def __init__(self, paths=(("answer", "answer"), ("answer",))):
+        self._paths = {tuple(p) for p in paths}
+        # Each frame: [is_object, current_key, expecting_key]
+        self._stack: list = []
+        self._in_string = False
+        self._string_is_key = False
+        self._emitting = False
+        self._escape = False
+        self._unicode: str | None = None
+        self._key_buf: list = []
+
+    def _path(self) -> tuple:
+        return tuple(frame[1] if frame[0] else "[]" for frame in self._stack)
+
+    def _on_string_char(self, ch: str, out: list):
+        if self._string_is_key:
+            self._key_buf.append(ch)
+        elif self._emitting:
+            out.append(ch)
+
+    def feed(self, chunk: str) -> str:
+        out: list = []
+        for c in chunk:
+            if self._in_string:
+                if self._unicode is not None:
+                    self._unicode += c
+                    if len(self._unicode) == 4:
+                        try:
+                            self._on_string_char(chr(int(self._unicode, 16)), out)
+                        except ValueError:
+                            pass
+                        self._unicode = None
+                elif self._escape:
+                    self._escape = False
+                    if c == "u":
+                        self._unicode = ""
+                    else:
+                        self._on_string_char(_JSON_ESCAPES.get(c, c), out)
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._string_is_key and self._stack:
+                        self._stack[-1][1] = "".join(self._key_buf)
+                    self._emitting = False
+                else:
+                    self._on_string_char(c, out)
+                continue
+            if c == '"':
+                self._in_string = True
+                top = self._stack[-1] if self._stack else None
+                self._string_is_key = bool(top and top[0] and top[2])
+                self._key_buf = []
+                self._emitting = not self._string_is_key and self._path() in self._paths
+            elif c == "{":
+                self._stack.append([True, None, True])
+            elif c == "[":
+                self._stack.append([False, None, False])
+            elif c in "}]":
+                if self._stack:
+                    self._stack.pop()
+            elif c == ":":
+                if self._stack and self._stack[-1][0]:
+                    self._stack[-1][2] = False
+            elif c == ",":
+                if self._stack and self._stack[-1][0]:
+                    self._stack[-1][1] = None
+                    self._stack[-1][2] = True
+        return "".join(out)
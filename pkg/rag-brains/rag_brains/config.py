@@ -8,3 +8,19 @@ BASE_PATH = os.getenv("OP_CHAT_BASE_PATH", os.path.expanduser("../../data"))
 SCOPE = os.getenv("RAG_SCOPE", "CoW Protocol / Order Book API / Integration")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "gemini-embedding-001")
 CHAT_MODEL = os.getenv("CHAT_MODEL", "gemini-2.0-flash")
+
+# Size of the shared thread pool for blocking Gemini SDK calls (bounds concurrent generate_content calls per process)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+
+# Embedding cache: in-process LRU size, and an optional directory for the float32 on-disk store
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "").strip()
+
+# Embedding call coalescing: concurrent requests' texts are sent together after waiting up to this many ms
+# (0 disables), or as soon as this many texts are queued
+EMBED_COALESCE_MS = float(os.getenv("EMBED_COALESCE_MS", "5"))
+EMBED_COALESCE_BATCH = int(os.getenv("EMBED_COALESCE_BATCH", "100"))
+
+# Send structured-output schemas through Gemini's native response_schema instead of pasting them into the prompt
+# (falls back to the prompt per schema if the API rejects it)
+GEMINI_NATIVE_SCHEMA = os.getenv("GEMINI_NATIVE_SCHEMA", "false").strip().lower() in ("1", "true", "yes")
@@ -0,0 +1,36 @@
+"""
+Pipeline metrics, registered in the process-wide cow_core.metrics registry (exported by cow_app at /metrics).
+
+Stages timed in STAGE_SECONDS: preprocessor_llm, query_embedding, faiss_search, context_filter,
+responder_llm, citations, data_exporter_refresh.
+"""
+from cow_core.metrics import counter, histogram
+
+STAGE_SECONDS = histogram("rag_stage_seconds", "Latency of each RAG pipeline stage.", ("stage",))
+REASONING_LEVELS = histogram(
+    "rag_reasoning_levels", "Reasoning levels used per answered question.", buckets=(0, 1, 2, 3, 4, 5)
+)
+PREPROCESSOR_PATH = counter(
+    "rag_preprocessor_total", "How the preprocessing decision was made (local router or LLM).", ("path",)
+)
+LLM_RETRIES = counter("rag_llm_retries_total", "LLM calls retried after a rate limit.", ("call",))
+LLM_RATE_LIMITED = counter("rag_llm_rate_limited_total", "LLM calls rejected with 429 (ResourceExhausted).", ("call",))
+LLM_TIMEOUTS = counter("rag_llm_timeouts_total", "LLM calls that timed out.", ("call",))
+LLM_PROMPT_TOKENS = histogram(
+    "rag_llm_prompt_tokens",
+    "Prompt tokens of structured LLM calls, by how the output schema was sent (native or prompt).",
+    ("schema_mode",),
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+LLM_PARSE_FAILURES = counter(
+    "rag_llm_parse_failures_total", "Structured LLM responses that were not valid JSON and needed repair.", ("schema_mode",)
+)
+CONTEXT_TOKENS = histogram(
+    "rag_context_tokens",
+    "Estimated tokens of the context packed into each responder prompt.",
+    buckets=(500, 1000, 2000, 4000, 6000, 8000, 12000, 16000, 32000),
+)
+CONTEXT_CHUNKS = counter("rag_context_chunks_total", "Retrieved chunks by packing outcome.", ("outcome",))
+CONTEXT_COMPRESSION_CHARS = counter(
+    "rag_context_compression_chars_total", "Characters of retrieved chunks before (input) and after (output) compression.", ("stage",)
+)
@@ -1,5 +1,6 @@
 """Load FAISS index from a local directory (used by cow_brains)."""
 from typing import Optional
+import hashlib
 import os
 from langchain_community.vectorstores import FAISS
 from rag_brains.chat.apis import access_APIs
@@ -27,3 +28,15 @@ async def load_faiss_indexes(
     if os.path.isdir(faiss_path):
         return FAISS.load_local(faiss_path, embeddings, allow_dangerous_deserialization=True)
     raise FileNotFoundError(f"FAISS index not found at {faiss_path}")
+
+
+def index_version(faiss_path: str) -> str:
+    """Content hash of the saved index files; changes whenever the index is rebuilt."""
+    h = hashlib.sha256()
+    for name in ("index.faiss", "index.pkl"):
+        path = os.path.join(faiss_path, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+    return h.hexdigest()[:16]
@@ -0,0 +1,152 @@
+"""FAISS retriever with a batched search: one embedding call and one multi-row index search for many queries."""
+from typing import Dict, Iterable, List, Optional
+import asyncio
+import json
+import os
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from cow_core.tracing import span
+from rag_brains.metrics import STAGE_SECONDS
+from rag_brains.retriever.connect_faiss import index_version
+
+try:
+    from cow_core.logger import get_logger
+    _logger = get_logger(__name__)
+except Exception:
+    _logger = None
+
+# Stored next to index.faiss / index.pkl; results of fixed queries for one index version
+PRECOMPUTED_FILE = "precomputed_queries.json"
+
+
+class FaissRetriever:
+    """Callable retriever over a loaded FAISS store (built by RetrieverBuilder.build_faiss_retriever).
+
+    `await retriever(query, contexts_df)` searches one query; `await retriever.search_many(queries)` embeds
+    all queries in a single embedding request and runs a single batched FAISS search. Fixed queries passed
+    to `warm()` are answered from precomputed results (no embedding, no search).
+    """
+
+    def __init__(self, db: FAISS, k: int = 4, index_path: Optional[str] = None, **search_pars):
+        self.db = db
+        self.k = k
+        self.index_path = index_path
+        self.search_pars = search_pars
+        self.precomputed: Dict[str, List[Document]] = {}
+        self._index_version: Optional[str] = None
+
+    @property
+    def index_version(self) -> str:
+        if self._index_version is None:
+            self._index_version = index_version(self.index_path) if self.index_path else ""
+        return self._index_version
+
+    async def __call__(self, query: str, contexts_df=None, **kwargs) -> List[Document]:
+        if query in self.precomputed:
+            return list(self.precomputed[query])
+        # Embedding + search block on the network; run in a thread so concurrent retrievals overlap
+        if self.search_pars:
+            return await asyncio.to_thread(self.db.similarity_search, query, k=self.k, **self.search_pars)
+        return (await asyncio.to_thread(self._search_many_sync, [query]))[0]
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        embedder = self.db.embedding_function
+        with STAGE_SECONDS.time(stage="query_embedding"):
+            if hasattr(embedder, "embed_documents"):
+                vectors = embedder.embed_documents(list(queries))
+            else:
+                vectors = [embedder(q) for q in queries]
+        return np.asarray(vectors, dtype=np.float32)
+
+    def search_ids(self, vectors: np.ndarray, k: Optional[int] = None) -> List[List[str]]:
+        """Batched FAISS search for already-embedded queries (one row per query); returns docstore ids."""
+        vectors = np.array(vectors, dtype=np.float32, copy=True)
+        if getattr(self.db, "_normalize_L2", False):
+            faiss.normalize_L2(vectors)
+        with STAGE_SECONDS.time(stage="faiss_search"):
+            _, indices = self.db.index.search(vectors, k or self.k)
+        return [[self.db.index_to_docstore_id[i] for i in row if i != -1] for row in indices]
+
+    def documents(self, ids: Iterable[str]) -> List[Document]:
+        docs = []
+        for _id in ids:
+            doc = self.db.docstore.search(_id)
+            if isinstance(doc, Document):
+                docs.append(doc)
+        return docs
+
+    def search_vectors(self, vectors: np.ndarray, k: Optional[int] = None) -> List[List[Document]]:
+        return [self.documents(ids) for ids in self.search_ids(vectors, k)]
+
+    def _search_many_sync(self, queries: List[str]) -> List[List[Document]]:
+        if self.search_pars:
+            # Filters etc. are only supported by the per-query LangChain path
+            return [self.db.similarity_search(q, k=self.k, **self.search_pars) for q in queries]
+        return self.search_vectors(self.embed_queries(queries))
+
+    async def search_many(self, queries: List[str]) -> List[List[Document]]:
+        """Search several queries at once; returns one result list per query, in order."""
+        todo = [q for q in dict.fromkeys(queries) if q not in self.precomputed]
+        found = dict(self.precomputed)
+        with span("faiss.search_many", k=self.k, queries=todo, precomputed=len(queries) - len(todo)) as s:
+            if todo:
+                found.update(zip(todo, await asyncio.to_thread(self._search_many_sync, todo)))
+            s.set(urls={q: [d.metadata.get("url") for d in found[q]] for q in todo})
+        return [list(found[q]) for q in queries]
+
+    def _precomputed_path(self) -> Optional[str]:
+        return os.path.join(self.index_path, PRECOMPUTED_FILE) if self.index_path else None
+
+    def _load_precomputed(self, queries: List[str]) -> Optional[Dict[str, List[str]]]:
+        path = self._precomputed_path()
+        if not path or not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored.get("index_version") != self.index_version or stored.get("k") != self.k:
+            return None
+        ids = stored.get("queries") or {}
+        if not all(q in ids for q in queries):
+            return None
+        return ids
+
+    def precompute(self, queries: Iterable[str], save: bool = True) -> Dict[str, List[str]]:
+        """Embed and search fixed queries once (blocking) and optionally store the ids next to the index."""
+        queries = list(dict.fromkeys(queries))
+        if not queries:
+            return {}
+        ids = dict(zip(queries, self.search_ids(self.embed_queries(queries))))
+        self.precomputed.update({q: self.documents(i) for q, i in ids.items()})
+        path = self._precomputed_path()
+        if save and path:
+            try:
+                with open(path, "w") as f:
+                    json.dump({"index_version": self.index_version, "k": self.k, "queries": ids}, f, indent=2)
+            except OSError as e:
+                # Read-only deploys still get the in-memory results
+                if _logger:
+                    _logger.warning(f"Could not store precomputed queries at {path}: {e}")
+        return ids
+
+    async def warm(self, queries: Iterable[str]) -> None:
+        """Make fixed queries free at serving time: load their stored results or compute them now."""
+        queries = list(dict.fromkeys(queries))
+        if self.search_pars or not queries:
+            return
+        ids = await asyncio.to_thread(self._load_precomputed, queries)
+        if ids is not None:
+            self.precomputed.update({q: self.documents(ids[q]) for q in queries})
+            return
+        try:
+            await asyncio.to_thread(self.precompute, queries)
+        except Exception as e:
+            # Not fatal: the queries are then searched live like any other
+            if _logger:
+                _logger.warning(f"Could not precompute fixed queries: {e}")
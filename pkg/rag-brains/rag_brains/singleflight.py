@@ -0,0 +1,55 @@
+"""
+Single-flight: concurrent calls with the same key share one execution and all receive its result.
+"""
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+import copy
+
+
+class SingleFlight:
+    """`await flight.do(key, fn)` runs `fn()` once per key at a time; later callers with the same key wait for
+    the running call instead of starting their own. Each caller gets its own deep copy of the result (or the
+    same exception). Cancelling one caller does not cancel the shared call; it is cancelled only when every
+    caller has gone away (e.g. all clients disconnected), so nobody's work is wasted and nobody's is lost.
+
+    The shared call runs in the first caller's context (contextvars such as the request deadline), so anything
+    from the context that changes the result must be part of the key.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self.executions = 0
+        self.shared = 0
+        self.abandoned = 0
+
+    def _forget(self, key: str, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+            self._waiters.pop(key, None)
+        # Consume the exception so it is not reported as never retrieved when every caller has left
+        if not future.cancelled():
+            future.exception()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            self._waiters[key] = 0
+            future.add_done_callback(lambda f, k=key: self._forget(k, f))
+            self.executions += 1
+        else:
+            self.shared += 1
+        self._waiters[key] += 1
+        try:
+            return copy.deepcopy(await asyncio.shield(future))
+        finally:
+            if self._calls.get(key) is future:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0 and not future.done():
+                    future.cancel()
+                    self.abandoned += 1
+
+    def in_flight(self) -> int:
+        return len(self._calls)